@@ -1,7 +1,30 @@
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import Dict, List, Optional, Sequence
+
+from records import SubscriptionRecord, prefix_bounds
+
+# Horodatages des enregistrements en µs depuis 1970-01-01
+_DAY = 86_400_000_000
+
+def _month_of_day(day: int) -> int:
+    """
+    Mois (année * 12 + mois - 1) du jour compté depuis 1970-01-01, en
+    arithmétique entière (algorithme civil de H. Hinnant), sans datetime.
+    """
+    z = day + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    m = mp + 3 if mp < 10 else mp - 9
+    return (yoe + era * 400 + (m <= 2)) * 12 + m - 1
 
 class SubscriptionAnalyzer:
+    """
+    Calculs sur les SubscriptionRecord du store : lecture directe des slots
+    (cost, billing_cycle, start...), la forme dict n'est construite qu'en réponse.
+    """
     def __init__(self, db):
         self.db = db
 
@@ -16,27 +39,27 @@ class SubscriptionAnalyzer:
             return round(cost / 12.0, 2)
         return float(cost)
 
-    def calculate_monthly_spending(self, subs: List[Dict]) -> float:
+    def calculate_monthly_spending(self, subs: Sequence[SubscriptionRecord]) -> float:
         total = 0.0
         for s in subs:
-            total += self.normalize_to_monthly(s.get('cost', 0.0), s.get('billing_cycle','monthly'))
+            total += self.normalize_to_monthly(s.cost or 0.0, s.billing_cycle or 'monthly')
         return round(total, 2)
 
-    def find_unused_subscriptions(self, subs: List[Dict]) -> List[Dict]:
+    def find_unused_subscriptions(self, subs: Sequence[SubscriptionRecord]) -> List[Dict]:
         # MVP: renvoie vide (ou une détection bidon)
         return []
 
-    def find_duplicates(self, subs: List[Dict]) -> List[Dict]:
+    def find_duplicates(self, subs: Sequence[SubscriptionRecord]) -> List[Dict]:
         # MVP: group by name lower; si doublons => saving = cost d'un
         seen = {}
         dups = []
         for s in subs:
-            k = s.get('name','').strip().lower()
+            k = (s.name or '').strip().lower()
             seen.setdefault(k, []).append(s)
         for k, lst in seen.items():
             if len(lst) > 1:
-                saving = min([x.get('cost',0) for x in lst])
-                dups.append({"services":[x.get('name') for x in lst], "potential_saving": saving})
+                saving = min([x.cost or 0 for x in lst])
+                dups.append({"services":[x.name for x in lst], "potential_saving": saving})
         return dups
 
     def find_alternatives(self, name: str):
@@ -46,3 +69,58 @@ class SubscriptionAnalyzer:
             "Dropbox Plus": ["Google One", "iCloud+"]
         }
         return mapping.get(name, [])
+
+    def monthly_series(
+        self, subs: Sequence[SubscriptionRecord], start: Optional[str] = None, end: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Dépense mensuelle mois par mois, en une seule passe sur les abonnements :
+        +coût au mois de début, -coût le mois suivant l'annulation, puis somme cumulée.
+        start / end ("YYYY-MM...") bornent la série ; par défaut du 1er début au mois courant.
+
+        Cumul par jour sur les horodatages entiers, puis conversion des seuls
+        jours distincts en mois : aucune date ISO reconstruite par abonnement.
+        """
+        starts: Dict[int, float] = {}
+        stops: Dict[int, float] = {}
+        normalize = self.normalize_to_monthly
+        for s in subs:
+            if s.start is None:
+                continue
+            cost = normalize(s.cost or 0.0, s.billing_cycle or 'monthly')
+            day = s.start // _DAY
+            starts[day] = starts.get(day, 0.0) + cost
+            if s.status == 'cancelled' and s.cancelled is not None:
+                day = s.cancelled // _DAY
+                stops[day] = stops.get(day, 0.0) + cost
+
+        deltas: Dict[int, float] = {}
+        for day, cost in starts.items():
+            month = _month_of_day(day)
+            deltas[month] = deltas.get(month, 0.0) + cost
+        for day, cost in stops.items():
+            month = _month_of_day(day) + 1
+            deltas[month] = deltas.get(month, 0.0) - cost
+
+        # Bornes normalisées comme l'index start_date ("2025" -> 2025-01 .. 2025-12)
+        first = self._bound_month(start, 0) if start else _month_of_day(min(starts)) if starts else None
+        if end:
+            last = self._bound_month(end, 1)
+        else:
+            now = datetime.now()
+            last = now.year * 12 + now.month - 1
+        if first is None or first > last:
+            return []
+
+        # Report du cumul antérieur à la fenêtre
+        running = sum(v for m, v in deltas.items() if m < first)
+        series = []
+        for month in range(first, last + 1):
+            running += deltas.get(month, 0.0)
+            series.append({"month": f"{month // 12:04d}-{month % 12 + 1:02d}", "total": round(running, 2)})
+        return series
+
+    @staticmethod
+    def _bound_month(prefix: str, side: int) -> int:
+        """Mois de la borne basse (side=0) ou haute (side=1) d'un préfixe ISO."""
+        return _month_of_day(prefix_bounds(prefix)[side] // _DAY)
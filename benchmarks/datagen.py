@@ -0,0 +1,191 @@
+# benchmarks/datagen.py
+"""
+Données synthétiques reproductibles (même seed -> mêmes données) :
+reçus e-mail, messages Gmail, relevés bancaires CSV et abonnements.
+
+Les générateurs sont paresseux : 10M de lignes CSV s'écrivent sans tout
+garder en mémoire.
+
+    python -m benchmarks.datagen csv --rows 10000000 --out bank.csv
+    python -m benchmarks.datagen receipts --rows 100000 --out receipts.jsonl
+"""
+import argparse
+import base64
+import csv
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+# Services reconnus par EmailParser, avec leur prix habituel
+RECEIPT_SERVICES = [
+    ("BasicFit", 29.99), ("PowerProt", 4.99), ("Watch Watch", 8.99),
+    ("RadioJazz", 5.0), ("Google Cloud", 12.37),
+]
+RECEIPT_TEMPLATES = [
+    "Your {service} subscription of {amount}{symbol} has been renewed",
+    "{service}: payment received {amount}{symbol} - thank you for your order",
+    "Receipt from {service}\nAmount charged: {amount}{symbol}\nNext billing date: {date}",
+    "Confirmation d'abonnement {service} : {amount} {symbol} prélevés le {date}",
+]
+# Bruit : mails sans abonnement reconnu
+NOISE_EMAILS = [
+    "Your order #{n} has shipped and should arrive on {date}",
+    "Weekly newsletter: {n} new articles you might like",
+    "Invoice {n} from Acme Hosting: {amount}{symbol} due on {date}",
+]
+
+# Libellés reconnus par BankCSVParser, puis opérations courantes
+CSV_SUBSCRIPTIONS = [
+    ("PRLV SEPA NETFLIX.COM", 15.99), ("CB SPOTIFY P1A2B3", 9.99),
+    ("ADOBE CREATIVE CLOUD IE", 54.99), ("DROPBOX*PLUS", 11.99), ("GITHUB PRO", 7.0),
+]
+CSV_NOISE = [
+    "CB CARREFOUR CITY", "VIR SEPA LOYER", "CB SNCF INTERNET", "RETRAIT DAB",
+    "CB BOULANGERIE DU COIN", "PRLV SEPA EDF", "CB AMAZON EU SARL", "VIR SALAIRE",
+]
+
+SERVICES = [
+    ("Netflix", 15.99, "streaming"), ("Spotify", 9.99, "streaming"),
+    ("Adobe Creative Cloud", 54.99, "design"), ("Dropbox Plus", 11.99, "storage"),
+    ("GitHub Pro", 7.0, "dev"), ("Basicfit", 29.99, "fitness"),
+]
+
+BASE_DATE = datetime(2023, 1, 1)
+
+def _date(rnd: random.Random) -> datetime:
+    return BASE_DATE + timedelta(seconds=rnd.randrange(3 * 365 * 86400))
+
+def receipt(rnd: random.Random, filler_bytes: int = 0) -> str:
+    """Un reçu (80 % abonnement reconnu, 20 % bruit), complété jusqu'à filler_bytes."""
+    symbol = rnd.choice(("€", "€", "$"))
+    date = _date(rnd).strftime("%d/%m/%Y")
+    if rnd.random() < 0.8:
+        service, price = rnd.choice(RECEIPT_SERVICES)
+        amount = f"{price:.2f}".replace(".", rnd.choice((".", ",")))
+        text = rnd.choice(RECEIPT_TEMPLATES).format(service=service, amount=amount, symbol=symbol, date=date)
+    else:
+        text = rnd.choice(NOISE_EMAILS).format(
+            n=rnd.randrange(10**6), amount=f"{rnd.uniform(1, 500):.2f}", symbol=symbol, date=date
+        )
+    if filler_bytes > len(text):
+        # Pied de mail typique (mentions légales, désinscription...) répété
+        footer = "\nYou are receiving this email because you have an account with us. Unsubscribe."
+        text += footer * ((filler_bytes - len(text)) // len(footer) + 1)
+        text = text[:filler_bytes]
+    return text
+
+def receipts(count: int, seed: int = 42, filler_bytes: int = 0) -> Iterator[str]:
+    rnd = random.Random(seed)
+    for _ in range(count):
+        yield receipt(rnd, filler_bytes)
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+def message_id(index: int) -> str:
+    return f"{index:016x}"
+
+def gmail_message(index: int, seed: int = 42, body_bytes: int = 2000, multipart: bool = True) -> Dict:
+    """
+    Réponse de messages().get(format="full") pour le message index : même
+    structure que l'API (payload, parts base64url, snippet, sizeEstimate).
+    Déterministe : ne dépend que de (index, seed).
+    """
+    rnd = random.Random(seed * 1_000_003 + index)
+    text = receipt(rnd, body_bytes)
+    if multipart:
+        html = "<html><body><p>" + text.replace("\n", "<br>") + "</p></body></html>"
+        payload = {
+            "mimeType": "multipart/alternative",
+            "body": {"size": 0},
+            # text/html en premier : oblige à chercher la part text/plain
+            "parts": [
+                {"mimeType": "text/html", "body": {"size": len(html), "data": _b64(html)}},
+                {"mimeType": "text/plain", "body": {"size": len(text), "data": _b64(text)}},
+            ],
+        }
+    else:
+        payload = {"mimeType": "text/plain", "body": {"size": len(text), "data": _b64(text)}}
+    return {
+        "id": message_id(index),
+        "threadId": message_id(index),
+        "snippet": text[:200],
+        "sizeEstimate": len(text) * (3 if multipart else 1),
+        "payload": payload,
+    }
+
+def bank_rows(count: int, seed: int = 42) -> Iterator[Dict[str, str]]:
+    """Lignes de relevé : ~10 % d'abonnements, quelques montants invalides."""
+    rnd = random.Random(seed)
+    for _ in range(count):
+        day = _date(rnd).strftime("%Y-%m-%d")
+        r = rnd.random()
+        if r < 0.1:
+            label, price = rnd.choice(CSV_SUBSCRIPTIONS)
+            amount = f"-{price:.2f}"
+        elif r < 0.101:
+            label, amount = rnd.choice(CSV_NOISE), "N/A"
+        else:
+            label, amount = rnd.choice(CSV_NOISE), f"-{rnd.uniform(1, 300):.2f}"
+        yield {"date": day, "description": label, "amount": amount}
+
+def write_bank_csv(path: str, count: int, seed: int = 42, bank_format: str = "generic") -> str:
+    """
+    Écrit un relevé CSV en streaming. bank_format="fr" utilise les colonnes
+    libelle / montant (également lues par BankCSVParser).
+    """
+    if bank_format == "fr":
+        header = {"date": "date", "description": "libelle", "amount": "montant"}
+    else:
+        header = {"date": "date", "description": "description", "amount": "amount"}
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header.values())
+        writer.writerows((row["date"], row["description"], row["amount"]) for row in bank_rows(count, seed))
+    return path
+
+def subscription_rows(count: int, seed: int = 42) -> Iterator[Dict]:
+    """
+    Abonnements tels que reçus par add_subscription : chaque ligne est décodée
+    depuis du JSON, donc chaînes fraîches comme en production.
+    """
+    rnd = random.Random(seed)
+    for _ in range(count):
+        name, cost, category = rnd.choice(SERVICES)
+        start = BASE_DATE + timedelta(seconds=rnd.randrange(3 * 365 * 86400), microseconds=rnd.randrange(10**6))
+        yield json.loads(json.dumps({
+            'id': str(uuid.UUID(int=rnd.getrandbits(128), version=4)),
+            'name': name,
+            'cost': cost,
+            'currency': 'EUR',
+            'billing_cycle': rnd.choice(('monthly', 'yearly')),
+            'category': category,
+            'status': rnd.choice(('active', 'active', 'active', 'cancelled')),
+            'start_date': start.isoformat(),
+            'created_at': (start + timedelta(microseconds=rnd.randrange(500))).isoformat(),
+        }))
+
+def main(argv: Optional[list] = None) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("kind", choices=["csv", "receipts", "subscriptions"])
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--bank-format", choices=["generic", "fr"], default="generic")
+    args = ap.parse_args(argv)
+
+    if args.kind == "csv":
+        write_bank_csv(args.out, args.rows, args.seed, args.bank_format)
+        return
+    with open(args.out, "w", encoding="utf-8") as f:
+        if args.kind == "receipts":
+            for text in receipts(args.rows, args.seed):
+                f.write(json.dumps(text) + "\n")
+        else:
+            for row in subscription_rows(args.rows, args.seed):
+                f.write(json.dumps(row) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# benchmarks/fake_gmail.py
+"""
+Faux client Gmail en mémoire : même surface que l'objet renvoyé par
+googleapiclient build("gmail", "v1") pour ce qu'utilise le serveur,
+c.-à-d. service.users().messages().list(...).execute() et .get(...).execute().
+
+Les messages sont générés à la demande (benchmarks.datagen.gmail_message),
+la latence est simulée par un sleep bloquant, comme l'appel HTTP réel
+(qui passe par asyncio.to_thread côté serveur).
+
+Injection de fautes (vraies googleapiclient.errors.HttpError) : quota par
+seconde et plafond d'appels simultanés (429), erreurs 5xx aléatoires, panne
+(503) à partir du N-ième get servi.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from benchmarks.datagen import gmail_message, message_id
+
+class _Request:
+    """Équivalent de googleapiclient.http.HttpRequest : rien ne part avant execute()."""
+    def __init__(self, service: "FakeGmailService", method: str, call: Callable[[], Dict]):
+        self._service = service
+        self._method = method
+        self._call = call
+
+    def execute(self, num_retries: int = 0) -> Dict:
+        self._service._before(self._method)
+        try:
+            return self._call()
+        finally:
+            self._service._after()
+
+class _Messages:
+    def __init__(self, service: "FakeGmailService"):
+        self._service = service
+
+    def list(self, userId: str = "me", q: Optional[str] = None, maxResults: int = 100,
+             pageToken: Optional[str] = None, **_: Any) -> _Request:
+        s = self._service
+
+        def call() -> Dict:
+            start = int(pageToken) if pageToken else 0
+            # L'API plafonne maxResults à 500 par page
+            end = min(start + min(maxResults, 500), s.count)
+            page: Dict[str, Any] = {
+                "messages": [{"id": message_id(i), "threadId": message_id(i)} for i in range(start, end)],
+                "resultSizeEstimate": s.count,
+            }
+            if end < s.count:
+                page["nextPageToken"] = str(end)
+            return page
+
+        return _Request(s, "list", call)
+
+    def get(self, userId: str = "me", id: str = "", format: str = "full", **_: Any) -> _Request:
+        s = self._service
+
+        def call() -> Dict:
+            index = int(id, 16)
+            if not 0 <= index < s.count:
+                raise KeyError(f"Requested entity was not found: {id}")
+            msg = gmail_message(index, s.seed, s.body_bytes, s.multipart)
+            if format == "metadata":
+                msg.pop("payload")
+            return msg
+
+        return _Request(s, "get", call)
+
+class _Users:
+    def __init__(self, service: "FakeGmailService"):
+        self._service = service
+
+    def messages(self) -> _Messages:
+        return _Messages(self._service)
+
+class FakeGmailService:
+    """
+    count: messages dans la boîte
+    body_bytes / multipart: taille et forme des payloads
+    latency_ms / jitter_ms: délai de chaque execute() (jitter uniforme, tiré
+      d'un Random dédié donc reproductible à seed égal)
+    quota_units_per_second: quota simulé (5 unités par appel, rafale d'une
+      seconde) ; au-delà -> 429 rateLimitExceeded
+    max_concurrent: au-delà de ce nombre d'appels simultanés -> 429
+    error_rate: probabilité d'un 500 / 503 par appel
+    outage_after_gets: après ce nombre de get servis, tous les get -> 503
+      (remettre à None pour lever la panne)
+    """
+    def __init__(
+        self,
+        count: int = 1000,
+        seed: int = 42,
+        body_bytes: int = 2000,
+        multipart: bool = True,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        quota_units_per_second: float = 0.0,
+        max_concurrent: int = 0,
+        error_rate: float = 0.0,
+        outage_after_gets: Optional[int] = None,
+    ):
+        self.count = count
+        self.seed = seed
+        self.body_bytes = body_bytes
+        self.multipart = multipart
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota_units_per_second = quota_units_per_second
+        self.max_concurrent = max_concurrent
+        self.error_rate = error_rate
+        self.outage_after_gets = outage_after_gets
+        self.calls: Counter = Counter()
+        self.faults: Counter = Counter()
+        self.served: Counter = Counter()
+        self.peak_concurrent = 0
+        self._in_flight = 0
+        self._tokens = quota_units_per_second
+        self._updated = time.monotonic()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def users(self) -> _Users:
+        return _Users(self)
+
+    def _fault(self, method: str) -> Optional[int]:
+        """Statut HTTP de la faute à injecter (appelé sous le verrou)."""
+        if self.outage_after_gets is not None and method == "get" and self.served["get"] >= self.outage_after_gets:
+            return 503
+        if self.max_concurrent and self._in_flight > self.max_concurrent:
+            return 429
+        if self.quota_units_per_second:
+            now = time.monotonic()
+            rate = self.quota_units_per_second
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens < 5:
+                return 429
+            self._tokens -= 5
+        if self.error_rate and self._rnd.random() < self.error_rate:
+            return self._rnd.choice((500, 503))
+        self.served[method] += 1
+        return None
+
+    def _before(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+            self._in_flight += 1
+            self.peak_concurrent = max(self.peak_concurrent, self._in_flight)
+            delay = self.latency_ms + (self._rnd.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+            status = self._fault(method)
+            if status is not None:
+                self.faults[status] += 1
+        if delay:
+            time.sleep(delay / 1000)
+        if status is not None:
+            self._after()
+            raise _http_error(status)
+
+    def _after(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+def _http_error(status: int) -> HttpError:
+    reason = "rateLimitExceeded" if status == 429 else "backendError"
+    content = {"error": {"code": status, "message": f"fake {reason}", "errors": [{"reason": reason}]}}
+    return HttpError(httplib2.Response({"status": status}), json.dumps(content).encode("utf-8"))
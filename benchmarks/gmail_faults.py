@@ -0,0 +1,208 @@
+# benchmarks/gmail_faults.py
+"""
+Scans Gmail (run_http._scan) contre FakeGmailService avec injection de
+fautes : vérifie que l'ordonnanceur (gmail_scheduler) absorbe quota, 429 de
+concurrence et 5xx, et qu'un scan interrompu reprend sans relire ni
+réenregistrer les messages déjà traités.
+
+    python -m benchmarks.gmail_faults
+    python -m benchmarks.gmail_faults --only quota,outage_resume --messages 500
+
+Code de sortie 1 si un scénario ne respecte pas ses attentes.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.fake_gmail import FakeGmailService
+from benchmarks.run import _import_server
+from gmail_scheduler import SCHEDULERS, GmailScheduler
+
+class Scenario(NamedTuple):
+    service: Dict[str, Any]    # paramètres de FakeGmailService
+    scheduler: Dict[str, Any]  # paramètres de GmailScheduler
+    check: Callable[["Outcome"], List[str]]
+    overlapping: int = 1       # scans identiques lancés en même temps
+
+class Outcome(NamedTuple):
+    service: FakeGmailService
+    scheduler: GmailScheduler
+    seconds: float
+    found: int
+    expected: int
+    records: int
+    errors: List[str]
+    first_pass: Optional[Dict[str, Any]]
+
+def _complete(o: Outcome) -> List[str]:
+    failures = []
+    if o.found != o.expected:
+        failures.append(f"found {o.found} subscriptions, expected {o.expected}")
+    if o.records != o.found:
+        failures.append(f"{o.records} records stored for {o.found} subscriptions")
+    if o.errors:
+        failures.append(f"{len(o.errors)} errors, first: {o.errors[0]}")
+    return failures
+
+def _check_clean(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    if o.scheduler.retries:
+        failures.append(f"{o.scheduler.retries} retries without injected faults")
+    return failures
+
+def _check_quota(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    # 5 unités par get, rafale initiale d'une seconde de quota comprise
+    floor = (o.service.calls["get"] * 5 - o.service.quota_units_per_second) / o.service.quota_units_per_second
+    if o.seconds < floor * 0.9:
+        failures.append(f"{o.seconds:.2f}s is faster than the quota allows ({floor:.2f}s)")
+    return failures
+
+def _check_matched(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    if o.service.faults[429] > 0.05 * sum(o.service.calls.values()):
+        failures.append(f"{o.service.faults[429]} throttled calls with a matching client quota")
+    return failures
+
+def _check_concurrency(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    if not o.scheduler.throttled:
+        failures.append("no 429 seen, the scenario does not exercise AIMD")
+    # AIMD sonde au-dessus de la limite puis redescend : des 429, mais pas en
+    # continu (~0.3 par message servi ; ~0.8 et des messages perdus sans AIMD)
+    if o.service.faults[429] > 0.5 * o.service.served["get"]:
+        failures.append(f"{o.service.faults[429]} throttled calls for {o.service.served['get']} served")
+    return failures
+
+def _check_flaky(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    if not o.scheduler.retries:
+        failures.append("no retries with a 10% error rate")
+    return failures
+
+def _check_resume(o: Outcome) -> List[str]:
+    from run_http import GMAIL_BREAKER_FAILURES  # déjà importé par main_async
+
+    failures = _complete(o)
+    first = o.first_pass or {}
+    if not any("run the same scan again" in e for e in first.get("errors", [])):
+        failures.append("interrupted scan did not report the messages left to fetch")
+    if not 0 < first.get("found", 0) < o.expected:
+        failures.append(f"interrupted scan found {first.get('found')} subscriptions, expected a partial result")
+    if not any("gmail unavailable" in e for e in first.get("errors", [])):
+        failures.append("the circuit breaker did not stop the interrupted scan")
+    # coupe-circuit : quelques messages en échec par fetcher, pas toute la moitié restante
+    wasted = o.service.faults[503]
+    ceiling = (GMAIL_BREAKER_FAILURES + o.scheduler.max_concurrency) * (o.scheduler.max_retries + 1)
+    if wasted > ceiling:
+        failures.append(f"{wasted} calls during the outage, expected at most {ceiling}")
+    # chaque message servi une seule fois sur les deux passes, un seul list
+    if o.service.served["get"] != o.service.count or o.service.served["list"] != 1:
+        failures.append(f"served {dict(o.service.served)} for {o.service.count} messages")
+    return failures
+
+def _check_overlap(o: Outcome) -> List[str]:
+    failures = _complete(o)
+    # les scans simultanés partagent la liste et se répartissent les messages
+    if o.service.served["get"] != o.service.count or o.service.served["list"] != 1:
+        failures.append(f"served {dict(o.service.served)} for {o.service.count} messages")
+    return failures
+
+SCENARIOS: Dict[str, Scenario] = {
+    "clean": Scenario({}, {"units_per_second": 1000}, _check_clean),
+    # client réglé sur 4x le quota réel : les 429 doivent être absorbés
+    "quota": Scenario({"quota_units_per_second": 250}, {"units_per_second": 1000}, _check_quota),
+    "quota_matched": Scenario({"quota_units_per_second": 250}, {"units_per_second": 250}, _check_matched),
+    "concurrency": Scenario({"max_concurrent": 3}, {"units_per_second": 0, "max_concurrency": 8}, _check_concurrency),
+    "flaky": Scenario({"error_rate": 0.1}, {"units_per_second": 0}, _check_flaky),
+    # panne au milieu du scan, reprises vite épuisées, puis relance
+    "outage_resume": Scenario(
+        {"outage_after_gets": "half"}, {"units_per_second": 0, "max_retries": 2}, _check_resume,
+    ),
+    # le même scan relancé pendant qu'il tourne encore
+    "overlap": Scenario({}, {"units_per_second": 0}, _check_overlap, overlapping=2),
+}
+
+async def _stored(server, tenant: str) -> int:
+    async with server.shards.use(tenant) as db:
+        return sum(1 for r in db.snapshot().records if r.get("source_message_id"))
+
+async def run_scenario(server, name: str, args, expected: int) -> Outcome:
+    scenario = SCENARIOS[name]
+    params = dict(scenario.service)
+    if params.get("outage_after_gets") == "half":
+        params["outage_after_gets"] = args.messages // 2
+    service = FakeGmailService(
+        count=args.messages, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.latency_ms / 2, **params
+    )
+    server._load_gmail_credentials = lambda *_: None
+    server._gmail_client = lambda _creds: service
+    account = f"faults-{name}-{uuid.uuid4().hex[:8]}"
+    scheduler = SCHEDULERS[account] = GmailScheduler(
+        **{"base_delay": 0.05, "max_delay": 2.0, **scenario.scheduler}
+    )
+    tenant = f"faults-{name}-{uuid.uuid4().hex[:8]}"
+    credentials = {"token_file": account, "max_results": args.messages}
+
+    async def progress(done, total, found):
+        pass
+
+    start = time.perf_counter()
+    first_pass = None
+    errors: List[str] = []
+    passes = await asyncio.gather(*(
+        server._scan("gmail", credentials, tenant, progress, errors) for _ in range(scenario.overlapping)
+    ))
+    subscriptions = passes[0]
+    if any(len(p) != len(subscriptions) for p in passes):
+        errors.append(f"overlapping scans found {[len(p) for p in passes]} subscriptions")
+    if service.outage_after_gets is not None:
+        first_pass = {"found": len(subscriptions), "errors": errors}
+        service.outage_after_gets = None
+        errors = []
+        subscriptions = await server._scan("gmail", credentials, tenant, progress, errors)
+    seconds = time.perf_counter() - start
+    return Outcome(
+        service, scheduler, seconds, len(subscriptions), expected,
+        await _stored(server, tenant), errors, first_pass,
+    )
+
+async def main_async(args) -> int:
+    server = _import_server()
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    # référence : nombre d'abonnements détectables dans la boîte générée
+    reference = await run_scenario(server, "clean", args, expected=-1)
+    expected = reference.found
+
+    print(f"{'scenario':<15} {'seconds':>8} {'gets':>6} {'429':>5} {'5xx':>5} {'retries':>8} "
+          f"{'conc.':>6} {'peak':>5} {'found':>6}  result")
+    failed = False
+    for name in names:
+        o = await run_scenario(server, name, args, expected)
+        failures = SCENARIOS[name].check(o)
+        failed |= bool(failures)
+        faults = o.service.faults
+        print(f"{name:<15} {o.seconds:>8.2f} {o.service.calls['get']:>6} {faults[429]:>5} "
+              f"{faults[500] + faults[503]:>5} {o.scheduler.retries:>8} {o.scheduler.concurrency:>6} "
+              f"{o.service.peak_concurrent:>5} {o.found:>6}  {'FAIL' if failures else 'ok'}")
+        for line in failures:
+            print(f"    {line}")
+    return 1 if failed else 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--only", help="scénarios séparés par des virgules : " + ",".join(SCENARIOS))
+    ap.add_argument("--messages", type=int, default=200)
+    ap.add_argument("--latency-ms", type=float, default=10.0)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+    # un avertissement par message en échec : illisible à cette échelle
+    logging.getLogger("subscription-http").setLevel(logging.ERROR)
+    return asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
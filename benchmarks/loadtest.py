@@ -0,0 +1,422 @@
+# benchmarks/loadtest.py
+"""
+Test de charge de bout en bout sur /mcp (streamable HTTP) : N sessions MCP
+rejouent en boucle fermée un mélange d'appels d'outils décrit dans un
+fichier de workload (benchmarks/workloads/*.json).
+
+    python -m benchmarks.loadtest benchmarks/workloads/mixed.json
+    python -m benchmarks.loadtest benchmarks/workloads/read_heavy.json --sessions 100 --duration 60
+    python -m benchmarks.loadtest mixed.json --url http://127.0.0.1:8000/mcp --json out.json
+
+Sans --url, l'app (run_http.create_app) tourne dans un thread du même
+process sur un port local libre : pratique, mais les clients partagent le
+GIL avec le serveur. Pour des chiffres absolus, lancer le serveur à part
+(les scans CSV lisent le fichier côté serveur : même machine).
+
+Rapport : débit et latences par outil (p50/p95/p99/max), erreurs, et retard
+de la boucle asyncio du serveur (histogramme event_loop_lag_seconds de
+/metrics, différence avant/après le run).
+
+Format du workload :
+  sessions, duration_seconds, think_time_ms, seed_subscriptions (ajouts par
+  session avant la mesure), tenants (optionnel : sessions réparties sur ce
+  nombre de tenants via X-Tenant-Id, sinon un tenant par session ; le
+  serveur doit être sans état avec le même TENANT_HEADER_SECRET, ce que
+  fait le serveur lancé dans le process),
+  csv_rows (taille du relevé utilisé par {csv_path}),
+  mix : [{"tool", "weight", "args"}]. Une valeur d'argument "{nom}" est
+  remplacée par : service, cost, category, month, subscription_id (un id
+  ajouté par la session), csv_path.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+from benchmarks.datagen import SERVICES, write_bank_csv
+from benchmarks.run import _percentile, compare
+
+_PLACEHOLDER = re.compile(r"^\{(\w+)\}$")
+
+# --------------------------------------------------------------------
+# Serveur dans le process
+# --------------------------------------------------------------------
+class InProcessServer:
+    """uvicorn + create_app() dans un thread dédié (sa propre boucle asyncio)."""
+    def __init__(self, host: str = "127.0.0.1"):
+        self.host = host
+        self.port: Optional[int] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, tenant_header: bool = False) -> str:
+        """tenant_header: mode sans état + secret partagé, pour X-Tenant-Id."""
+        import secrets
+        import socket
+        import uvicorn
+
+        state_dir = tempfile.mkdtemp(prefix="loadtest-tenants-")
+        os.environ.setdefault("TENANT_STATE_DIR", state_dir)
+        os.environ.setdefault("SNAPSHOT_DIR", state_dir)
+        if tenant_header:
+            os.environ["MCP_STATELESS_HTTP"] = "1"
+            os.environ.setdefault("TENANT_HEADER_SECRET", secrets.token_hex(16))
+        import run_http
+
+        with socket.socket() as sock:
+            sock.bind((self.host, 0))
+            self.port = sock.getsockname()[1]
+        config = uvicorn.Config(
+            run_http.create_app(), host=self.host, port=self.port, log_level="warning", lifespan="on"
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name="loadtest-server", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 30
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("in-process server did not start")
+            time.sleep(0.05)
+        return f"http://{self.host}:{self.port}/mcp"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=30)
+
+# --------------------------------------------------------------------
+# Workload
+# --------------------------------------------------------------------
+def load_workload(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        workload = json.load(f)
+    if not workload.get("mix"):
+        raise ValueError(f"{path}: 'mix' is empty")
+    for entry in workload["mix"]:
+        if "tool" not in entry or entry.get("weight", 1) <= 0:
+            raise ValueError(f"{path}: invalid mix entry {entry}")
+    workload.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    return workload
+
+def _fill(value: Any, ctx: Dict[str, Any]) -> Any:
+    """Remplace les "{nom}" (valeur entière uniquement : le type est conservé)."""
+    if isinstance(value, str):
+        m = _PLACEHOLDER.match(value)
+        if m:
+            return ctx[m.group(1)]
+        return value
+    if isinstance(value, dict):
+        return {k: _fill(v, ctx) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, ctx) for v in value]
+    return value
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: List[str] = []
+
+    def record(self, tool: str, seconds: float, error: Optional[str]) -> None:
+        self.latencies[tool].append(seconds)
+        if error is not None:
+            self.errors[tool] += 1
+            if len(self.error_samples) < 5:
+                self.error_samples.append(f"{tool}: {error}")
+
+def _tool_error(result) -> Optional[str]:
+    if result.isError:
+        return result.content[0].text if result.content else "isError"
+    try:
+        data = json.loads(result.content[0].text)
+    except (IndexError, AttributeError, ValueError):
+        return None
+    if isinstance(data, dict) and data.get("success") is False:
+        return str(data.get("error"))
+    return None
+
+class AgentSession:
+    """Une session MCP qui rejoue le mix jusqu'à l'échéance."""
+    def __init__(self, index: int, url: str, workload: Dict[str, Any], shared: Dict[str, Any], seed: int):
+        self.index = index
+        self.url = url
+        self.workload = workload
+        self.shared = shared
+        self.rnd = random.Random(seed * 7919 + index)
+        self.ids: List[str] = []
+        tenants = workload.get("tenants")
+        self.headers = {
+            "X-Tenant-Id": f"loadtest-{index % tenants}",
+            "X-Tenant-Secret": os.environ.get("TENANT_HEADER_SECRET", ""),
+        } if tenants else None
+        self._mix = workload["mix"]
+        self._weights = [entry.get("weight", 1) for entry in self._mix]
+
+    def _context(self) -> Dict[str, Any]:
+        name, cost, category = self.rnd.choice(SERVICES)
+        now = time.localtime()
+        month = now.tm_mon - self.rnd.randrange(3)
+        year = now.tm_year + (month - 1) // 12
+        return {
+            "service": name,
+            "cost": cost,
+            "category": category,
+            "month": f"{year}-{(month - 1) % 12 + 1:02d}",
+            "subscription_id": self.rnd.choice(self.ids) if self.ids else None,
+            **self.shared,
+        }
+
+    async def _call(self, session: ClientSession, tool: str, args: Dict[str, Any]):
+        result = await session.call_tool(tool, args)
+        if tool == "add_subscription" and not result.isError:
+            try:
+                self.ids.append(json.loads(result.content[0].text)["subscription_id"])
+            except (KeyError, IndexError, ValueError):
+                pass
+        return result
+
+    async def run(
+        self, ready: asyncio.Barrier, go: asyncio.Event, start: List[float], stats: Stats, connect: List[float]
+    ) -> None:
+        t0 = time.perf_counter()
+        async with streamablehttp_client(self.url, headers=self.headers) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                connect.append(time.perf_counter() - t0)
+                for _ in range(self.workload.get("seed_subscriptions", 0)):
+                    ctx = self._context()
+                    result = await self._call(session, "add_subscription", {
+                        "name": ctx["service"], "cost": ctx["cost"], "category": ctx["category"],
+                        "cycle": "monthly",
+                    })
+                    error = _tool_error(result)
+                    if error:
+                        # Sans données de départ la mesure n'aurait pas de sens
+                        raise RuntimeError(f"session {self.index}: seeding failed: {error}")
+                await ready.wait()
+                await go.wait()
+                deadline = start[0] + self.workload["duration_seconds"]
+                think = self.workload.get("think_time_ms", 0) / 1000
+                while time.perf_counter() < deadline:
+                    entry = self.rnd.choices(self._mix, self._weights)[0]
+                    ctx = self._context()
+                    if "{subscription_id}" in json.dumps(entry.get("args", {})) and ctx["subscription_id"] is None:
+                        continue  # rien à annuler encore
+                    args = _fill(entry.get("args", {}), ctx)
+                    t = time.perf_counter()
+                    try:
+                        result = await self._call(session, entry["tool"], args)
+                        error = _tool_error(result)
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    stats.record(entry["tool"], time.perf_counter() - t, error)
+                    if think:
+                        await asyncio.sleep(self.rnd.expovariate(1 / think))
+
+# --------------------------------------------------------------------
+# Retard de boucle (via /metrics)
+# --------------------------------------------------------------------
+def _lag_histogram(text: str) -> Tuple[Dict[float, float], float, float]:
+    buckets: Dict[float, float] = {}
+    total = count = 0.0
+    for line in text.splitlines():
+        if line.startswith("event_loop_lag_seconds_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float("inf") if le == "+Inf" else float(le)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("event_loop_lag_seconds_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return buckets, total, count
+
+async def _scrape(metrics_url: str) -> Optional[str]:
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(metrics_url)
+            response.raise_for_status()
+            return response.text
+    except httpx.HTTPError:
+        return None
+
+def loop_lag(before: Optional[str], after: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Quantiles bornés par les buckets (p99 <= x ms) sur la durée du run."""
+    if before is None or after is None:
+        return None
+    b0, s0, c0 = _lag_histogram(before)
+    b1, s1, c1 = _lag_histogram(after)
+    samples = c1 - c0
+    if samples <= 0:
+        return None
+
+    def bound(q: float) -> Optional[float]:
+        for le in sorted(b1):
+            if b1[le] - b0.get(le, 0.0) >= q * samples:
+                return None if le == float("inf") else le * 1000
+        return None
+
+    return {
+        "samples": int(samples),
+        "mean_ms": round((s1 - s0) / samples * 1000, 3),
+        "p50_le_ms": bound(0.50),
+        "p99_le_ms": bound(0.99),
+    }
+
+# --------------------------------------------------------------------
+# Run
+# --------------------------------------------------------------------
+async def run_load(url: str, workload: Dict[str, Any], seed: int) -> Dict[str, Any]:
+    shared: Dict[str, Any] = {}
+    csv_path = None
+    if any("{csv_path}" in json.dumps(e.get("args", {})) for e in workload["mix"]):
+        fd, csv_path = tempfile.mkstemp(prefix="loadtest-bank-", suffix=".csv")
+        os.close(fd)
+        write_bank_csv(csv_path, workload.get("csv_rows", 1000), seed)
+        shared["csv_path"] = csv_path
+
+    sessions = workload["sessions"]
+    stats = Stats()
+    connect: List[float] = []
+    start: List[float] = [0.0]
+    # Les sessions + 1 (ce coroutine) : la mesure démarre quand toutes sont prêtes
+    ready = asyncio.Barrier(sessions + 1)
+    go = asyncio.Event()
+    agents = [AgentSession(i, url, workload, shared, seed) for i in range(sessions)]
+    metrics_url = url.rsplit("/mcp", 1)[0] + "/metrics"
+    try:
+        tasks = [asyncio.create_task(a.run(ready, go, start, stats, connect)) for a in agents]
+        waiter = asyncio.create_task(ready.wait())
+        done, _ = await asyncio.wait([waiter, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        if waiter not in done:
+            # Une session a échoué avant la mesure
+            waiter.cancel()
+            for t in tasks:
+                t.cancel()
+            failed = next(t for t in done if t.exception() is not None)
+            raise failed.exception()
+        before = await _scrape(metrics_url)
+        start[0] = time.perf_counter()
+        go.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - start[0]
+        after = await _scrape(metrics_url)
+    finally:
+        if csv_path:
+            os.remove(csv_path)
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    tools: Dict[str, Dict[str, Any]] = {}
+    all_latencies: List[float] = []
+    for tool, latencies in sorted(stats.latencies.items()):
+        all_latencies.extend(latencies)
+        tools[tool] = _summary(sorted(latencies), stats.errors.get(tool, 0), elapsed)
+    return {
+        "workload": workload["name"],
+        "sessions": sessions,
+        "seconds": round(elapsed, 2),
+        "session_failures": [f"{type(e).__name__}: {e}" for e in failures],
+        "connect_p99_ms": round(_percentile(sorted(connect), 0.99) * 1000, 1) if connect else None,
+        "total": _summary(sorted(all_latencies), sum(stats.errors.values()), elapsed),
+        "tools": tools,
+        "event_loop_lag": loop_lag(before, after),
+        "error_samples": stats.error_samples,
+    }
+
+def _summary(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    def ms(q):
+        value = _percentile(latencies, q)
+        return None if value is None else round(value * 1000, 2)
+    return {
+        "calls": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(0.50),
+        "p95_ms": ms(0.95),
+        "p99_ms": ms(0.99),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        # même clé que benchmarks.run pour compare()
+        "p99_us": round(_percentile(latencies, 0.99) * 1e6, 1) if latencies else None,
+    }
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"workload {report['workload']}: {report['sessions']} sessions, {report['seconds']} s, "
+          f"connect p99 {report['connect_p99_ms']} ms")
+    print(f"{'tool':<22} {'calls':>7} {'errors':>6} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    rows = list(report["tools"].items()) + [("TOTAL", report["total"])]
+    for tool, r in rows:
+        print(f"{tool:<22} {r['calls']:>7} {r['errors']:>6} {r['throughput']:>8} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}")
+    lag = report["event_loop_lag"]
+    if lag:
+        print(f"event loop lag: {lag['samples']} samples, mean {lag['mean_ms']} ms, "
+              f"p50 <= {lag['p50_le_ms']} ms, p99 <= {lag['p99_le_ms']} ms")
+    else:
+        print("event loop lag: unavailable (no /metrics)")
+    for line in report["error_samples"]:
+        print(f"error: {line}")
+    for line in report["session_failures"]:
+        print(f"session failed: {line}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("workload", help="fichier JSON (voir benchmarks/workloads)")
+    ap.add_argument("--url", help="serveur déjà lancé, ex. http://127.0.0.1:8000/mcp")
+    ap.add_argument("--sessions", type=int)
+    ap.add_argument("--duration", type=float)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", help="écrit le rapport dans ce fichier")
+    ap.add_argument("--baseline", help="rapport JSON précédent à comparer (même workload)")
+    ap.add_argument("--tolerance", type=float, default=0.30)
+    args = ap.parse_args(argv)
+
+    workload = load_workload(args.workload)
+    if args.sessions:
+        workload["sessions"] = args.sessions
+    if args.duration:
+        workload["duration_seconds"] = args.duration
+
+    server = None
+    url = args.url
+    if url is None:
+        server = InProcessServer()
+        url = server.start(tenant_header=bool(workload.get("tenants")))
+    try:
+        report = asyncio.run(run_load(url, workload, args.seed))
+    finally:
+        if server is not None:
+            server.stop()
+
+    regressions: List[str] = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (baseline.get("workload"), baseline.get("sessions")) != (report["workload"], report["sessions"]):
+            print("baseline is for another workload or session count, not compared", file=sys.stderr)
+        else:
+            regressions = compare(
+                {"TOTAL": report["total"], **report["tools"]},
+                {"TOTAL": baseline["total"], **baseline["tools"]},
+                args.tolerance,
+            )
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions or report["session_failures"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# benchmarks/record_memory.py
+"""
+Mémoire par abonnement : dict historique vs SubscriptionRecord.
+
+    python -m benchmarks.record_memory --count 1000000
+"""
+import argparse
+import asyncio
+import gc
+import tracemalloc
+from typing import Callable
+
+from benchmarks.datagen import subscription_rows as rows
+from connection import DatabaseManager
+from records import SubscriptionRecord
+
+def measure(label: str, count: int, build: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    held = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    per_record = current // count
+    print(f"{label:<28} {current / 2**20:10.1f} MiB  {per_record:6d} B/record")
+    return per_record
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--count", type=int, default=1_000_000)
+    args = ap.parse_args()
+    n = args.count
+
+    async def build_store():
+        db = DatabaseManager()
+        await db.add_subscriptions(rows(n))
+        return db
+
+    dicts = measure("list[dict]", n, lambda: list(rows(n)))
+    records = measure("list[SubscriptionRecord]", n, lambda: [SubscriptionRecord(r) for r in rows(n)])
+    store = measure("DatabaseManager (+index)", n, lambda: asyncio.run(build_store()))
+    print(f"record vs dict: {dicts / records:.1f}x smaller")
+    print(f"store (+index) vs dict: {dicts / store:.1f}x smaller")
+
+if __name__ == "__main__":
+    main()
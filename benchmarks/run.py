@@ -0,0 +1,361 @@
+# benchmarks/run.py
+"""
+Benchmarks par sous-système : débit, latence p50/p99 par opération et pic
+mémoire (tracemalloc, passe séparée pour ne pas fausser les temps), comparés
+à une baseline JSON.
+
+    python -m benchmarks.run                          # compare à benchmarks/baseline.json
+    python -m benchmarks.run --save-baseline          # réécrit la baseline
+    python -m benchmarks.run --only csv_parser --size 10000000
+    python -m benchmarks.run --only snapshot_restore --size 1000000 --repeat 1 --no-memory
+
+Les données sont générées avec une seed fixe (benchmarks.datagen) : deux
+runs avec les mêmes paramètres traitent exactement les mêmes entrées. Une
+baseline n'est comparée qu'à paramètres identiques, et reste propre à la
+machine qui l'a produite (voir "meta").
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from array import array
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from benchmarks.datagen import gmail_message, receipts, subscription_rows, write_bank_csv
+from benchmarks.fake_gmail import FakeGmailService
+from gmail_scheduler import SCHEDULERS, GmailScheduler
+from snapshots import read_snapshot, write_snapshot
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# (nombre d'éléments traités, durées par opération en secondes ; vide si timed=False)
+RunResult = Tuple[int, Sequence[float]]
+
+class Bench(NamedTuple):
+    op: str                                   # unité des p50/p99
+    setup: Callable[[argparse.Namespace], Any]
+    run: Callable[[Any, bool], RunResult]
+
+def _timed_loop(fn: Callable[[Any], Any], items: Sequence[Any], timed: bool) -> RunResult:
+    if not timed:
+        for item in items:
+            fn(item)
+        return len(items), ()
+    clock = time.perf_counter
+    durations = array("d")
+    append = durations.append
+    for item in items:
+        start = clock()
+        fn(item)
+        append(clock() - start)
+    return len(items), durations
+
+def _import_server():
+    # Import tardif : run_http crée ses singletons (store de tenants) à l'import.
+    state_dir = tempfile.mkdtemp(prefix="bench-tenants-")
+    os.environ.setdefault("TENANT_STATE_DIR", state_dir)
+    os.environ.setdefault("SNAPSHOT_DIR", state_dir)
+    import run_http
+    return run_http
+
+# --------------------------------------------------------------------
+# Sous-systèmes
+# --------------------------------------------------------------------
+def setup_email(args) -> List[str]:
+    return list(receipts(args.size, args.seed, args.body_bytes))
+
+def run_email(texts, timed):
+    from email_parser import EmailParser
+    return _timed_loop(EmailParser().parse_email, texts, timed)
+
+def setup_payload(args) -> Tuple[Callable, List[Dict]]:
+    extract = _import_server()._extract_text_from_payload
+    return extract, [gmail_message(i, args.seed, args.body_bytes)["payload"] for i in range(args.size)]
+
+def run_payload(state, timed):
+    extract, payloads = state
+    return _timed_loop(extract, payloads, timed)
+
+def setup_csv(args) -> Tuple[str, int, int]:
+    fd, path = tempfile.mkstemp(prefix="bench-bank-", suffix=".csv")
+    os.close(fd)
+    write_bank_csv(path, args.size, args.seed)
+    return path, args.size, args.repeat
+
+def run_csv(state, timed):
+    from csv_parser import BankCSVParser
+    path, rows, repeat = state
+    _, durations = _timed_loop(BankCSVParser().parse_csv, [path] * repeat, timed)
+    return rows * repeat, durations
+
+def setup_db_load(args) -> Tuple[List[Dict], int]:
+    return list(subscription_rows(args.size, args.seed)), args.repeat
+
+def run_db_load(state, timed):
+    from connection import DatabaseManager
+    rows, repeat = state
+
+    async def load(_):
+        await DatabaseManager().add_subscriptions(rows)
+
+    _, durations = _timed_loop(lambda r: asyncio.run(load(r)), range(repeat), timed)
+    return len(rows) * repeat, durations
+
+def setup_db_query(args):
+    from connection import DatabaseManager
+    rows = list(subscription_rows(args.size, args.seed))
+    db = DatabaseManager()
+    asyncio.run(db.add_subscriptions(rows))
+    # Mélange de requêtes reproductible : plages de mois, filtres, lookup par id
+    rnd = random.Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        kind = rnd.randrange(4)
+        month = f"{rnd.choice((2023, 2024, 2025))}-{rnd.randrange(1, 13):02d}"
+        if kind == 0:
+            queries.append(("query", {"start_date": month, "end_date": month}))
+        elif kind == 1:
+            queries.append(("query", {"status": "cancelled", "category": rnd.choice(("dev", "design"))}))
+        elif kind == 2:
+            queries.append(("query", {"start_date": month, "status": "active", "category": "streaming"}))
+        else:
+            queries.append(("get", rnd.choice(rows)["id"]))
+    return db, queries
+
+def run_db_query(state, timed):
+    db, queries = state
+
+    async def go():
+        clock = time.perf_counter
+        durations = array("d")
+        for kind, arg in queries:
+            start = clock()
+            if kind == "get":
+                await db.get_subscription(arg)
+            else:
+                await db.query_subscriptions(**arg)
+            if timed:
+                durations.append(clock() - start)
+        return len(queries), durations
+
+    return asyncio.run(go())
+
+def setup_snapshot(args) -> Tuple[str, Tuple, int]:
+    from connection import DatabaseManager
+    db = DatabaseManager()
+    db.bulk_load(subscription_rows(args.size, args.seed))
+    fd, path = tempfile.mkstemp(prefix="bench-", suffix=".snap.gz")
+    os.close(fd)
+    write_snapshot(path, db.snapshot().records)
+    return path, db.snapshot().records, args.repeat
+
+def run_snapshot_write(state, timed):
+    path, records, repeat = state
+    _, durations = _timed_loop(lambda _: write_snapshot(path, records), range(repeat), timed)
+    return len(records) * repeat, durations
+
+def run_snapshot_restore(state, timed):
+    """Lecture en streaming + construction du store avec index en bloc."""
+    from connection import DatabaseManager
+    path, records, repeat = state
+    _, durations = _timed_loop(lambda _: DatabaseManager().bulk_load(read_snapshot(path)), range(repeat), timed)
+    return len(records) * repeat, durations
+
+def setup_gmail_scan(args):
+    server = _import_server()
+    service = FakeGmailService(
+        count=args.gmail_messages, seed=args.seed, body_bytes=args.body_bytes,
+        latency_ms=args.gmail_latency_ms,
+    )
+    # Remplace les credentials OAuth et le client construit par _gmail_client (discovery).
+    server._load_gmail_credentials = lambda *_: None
+    server._gmail_client = lambda _creds: service
+    # Coût côté serveur, pas le quota Gmail : seau à jetons désactivé
+    SCHEDULERS["token.json"] = GmailScheduler(units_per_second=0)
+    return server, args.gmail_messages
+
+def run_gmail_scan(state, timed):
+    """Scan complet (list + get + extraction + parsing + écriture dans le store)."""
+    server, count = state
+    clock = time.perf_counter
+    marks = array("d")
+
+    async def progress(done, total, found):
+        marks.append(clock())
+
+    async def go():
+        errors: List[str] = []
+        marks.append(clock())
+        credentials = {"max_results": count}
+        await server._scan("gmail", credentials, f"bench-{uuid.uuid4().hex[:8]}", progress, errors)
+        if errors:
+            raise RuntimeError(f"{len(errors)} messages failed: {errors[0]}")
+
+    asyncio.run(go())
+    # marks[1] = fin du list ; les suivants = un message chacun
+    durations = [b - a for a, b in zip(marks[1:], marks[2:])] if timed else ()
+    return count, durations
+
+BENCHMARKS: Dict[str, Bench] = {
+    "email_parser": Bench("email", setup_email, run_email),
+    "extract_payload": Bench("payload", setup_payload, run_payload),
+    "csv_parser": Bench("file", setup_csv, run_csv),
+    "db_load": Bench("bulk load", setup_db_load, run_db_load),
+    "db_query": Bench("query", setup_db_query, run_db_query),
+    "snapshot_write": Bench("file", setup_snapshot, run_snapshot_write),
+    "snapshot_restore": Bench("file", setup_snapshot, run_snapshot_restore),
+    "gmail_scan": Bench("message", setup_gmail_scan, run_gmail_scan),
+}
+
+# --------------------------------------------------------------------
+# Mesure et comparaison
+# --------------------------------------------------------------------
+def _percentile(sorted_values: Sequence[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def measure(bench: Bench, args) -> Dict[str, Any]:
+    state = bench.setup(args)
+    try:
+        gc.collect()
+        start = time.perf_counter()
+        items, durations = bench.run(state, True)
+        elapsed = time.perf_counter() - start
+        durations = sorted(durations)
+        result = {
+            "op": bench.op,
+            "items": items,
+            "seconds": round(elapsed, 4),
+            "throughput": round(items / elapsed, 1) if elapsed else None,
+            "p50_us": round(_percentile(durations, 0.50) * 1e6, 1) if durations else None,
+            "p99_us": round(_percentile(durations, 0.99) * 1e6, 1) if durations else None,
+            "peak_mib": None,
+        }
+        del durations
+        if args.memory:
+            gc.collect()
+            tracemalloc.start()
+            bench.run(state, False)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["peak_mib"] = round(peak / 2**20, 2)
+        return result
+    finally:
+        if bench.setup in (setup_csv, setup_snapshot):
+            os.remove(state[0])
+
+# (métrique, sens : +1 = plus haut est mieux)
+COMPARED = (("throughput", 1), ("p99_us", -1), ("peak_mib", -1))
+
+def compare(
+    results: Dict[str, Dict],
+    baseline: Dict[str, Dict],
+    tolerance: float,
+    compared: Sequence[Tuple[str, int]] = COMPARED,
+) -> List[str]:
+    """Renvoie la liste des régressions au-delà de la tolérance (relative)."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, direction in compared:
+            old, new = base.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * direction
+            current.setdefault("vs_baseline", {})[metric] = round((new - old) / old * 100, 1)
+            if change < -tolerance:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({(new - old) / old:+.0%})")
+    return regressions
+
+def _params(args) -> Dict[str, Any]:
+    return {k: getattr(args, k) for k in ("size", "seed", "repeat", "queries", "body_bytes",
+                                          "gmail_messages", "gmail_latency_ms")}
+
+def _print_table(results: Dict[str, Dict]) -> None:
+    print(f"{'benchmark':<16} {'op':<10} {'items':>9} {'items/s':>12} {'p50 µs':>10} {'p99 µs':>10} "
+          f"{'peak MiB':>9}  vs baseline")
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+    for name, r in results.items():
+        delta = ", ".join(f"{k} {v:+.1f}%" for k, v in r.get("vs_baseline", {}).items())
+        print(f"{name:<16} {r['op']:<10} {r['items']:>9} {fmt(r['throughput'], ',.0f'):>12} "
+              f"{fmt(r['p50_us'], '.1f'):>10} {fmt(r['p99_us'], '.1f'):>10} {fmt(r['peak_mib'], '.2f'):>9}  {delta}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--only", help="liste séparée par des virgules parmi : " + ", ".join(BENCHMARKS))
+    ap.add_argument("--size", type=int, default=10_000, help="e-mails, payloads, lignes CSV, abonnements")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--repeat", type=int, default=3, help="passes csv_parser / db_load / snapshot_*")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--body-bytes", type=int, default=2000)
+    ap.add_argument("--gmail-messages", type=int, default=500)
+    ap.add_argument("--gmail-latency-ms", type=float, default=0.0)
+    ap.add_argument("--no-memory", dest="memory", action="store_false", help="sans passe tracemalloc")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.30, help="écart relatif toléré (0.30 = 30 %%)")
+    ap.add_argument("--json", help="écrit aussi les résultats dans ce fichier")
+    args = ap.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = measure(BENCHMARKS[name], args)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": _params(args),
+        "results": results,
+    }
+
+    regressions: List[str] = []
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            # On garde les sous-systèmes non relancés (--only)
+            with open(args.baseline, encoding="utf-8") as f:
+                previous = json.load(f)
+            if previous.get("params") == report["params"]:
+                report["results"] = {**previous["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != report["params"]:
+            print("baseline params differ, not compared: " + json.dumps(baseline.get("params")), file=sys.stderr)
+        else:
+            regressions = compare(results, baseline["results"], args.tolerance)
+
+    _print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# benchmarks/startup.py
+"""
+Démarrage à froid du serveur : temps d'import de run_http et de
+create_app(), mesurés dans des process neufs, avec la répartition du temps
+d'import par paquet (python -X importtime).
+
+    python -m benchmarks.startup                  # compare à benchmarks/startup_baseline.json
+    python -m benchmarks.startup --save-baseline
+    python -m benchmarks.startup --runs 10 --top 20
+
+Échoue aussi (code 1) si un module différé (pile Gmail/OAuth) est chargé
+au démarrage.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from benchmarks.run import compare
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "startup_baseline.json")
+
+# Paquets qui ne doivent être importés qu'au premier scan Gmail / au pré-chargement
+DEFERRED_PACKAGES = ("google", "googleapiclient", "google_auth_oauthlib")
+
+_CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import run_http
+t1 = time.perf_counter()
+run_http.create_app()
+t2 = time.perf_counter()
+deferred = sorted(m for m in sys.modules if m.split(".")[0] in {deferred!r})
+print(json.dumps({{"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000, "deferred": deferred}}))
+"""
+
+def _by_package(importtime: str) -> Dict[str, float]:
+    """Temps propre (µs) de chaque module, regroupé par paquet de premier niveau."""
+    totals: Dict[str, float] = defaultdict(float)
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        totals[name.strip().split(".")[0]] += float(self_us)
+    return totals
+
+def run_once() -> Dict:
+    state_dir = tempfile.mkdtemp(prefix="startup-tenants-")
+    env = dict(os.environ, TENANT_STATE_DIR=state_dir, SNAPSHOT_DIR=state_dir)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD.format(deferred=DEFERRED_PACKAGES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["packages_us"] = _by_package(proc.stderr)
+    return result
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=12, help="paquets affichés")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.30)
+    args = ap.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    packages = defaultdict(list)
+    for r in runs:
+        for name, us in r["packages_us"].items():
+            packages[name].append(us)
+    median_ms = {name: statistics.median(v + [0.0] * (len(runs) - len(v))) / 1000 for name, v in packages.items()}
+    report = {
+        "runs": args.runs,
+        "results": {
+            "startup": {
+                "import_ms": round(statistics.median(r["import_ms"] for r in runs), 1),
+                "create_app_ms": round(statistics.median(r["create_app_ms"] for r in runs), 1),
+            },
+        },
+        "packages_ms": {n: round(ms, 1) for n, ms in sorted(median_ms.items(), key=lambda kv: -kv[1])},
+    }
+    deferred = sorted({m for r in runs for m in r["deferred"]})
+
+    startup = report["results"]["startup"]
+    print(f"import run_http: {startup['import_ms']} ms, create_app(): {startup['create_app_ms']} ms "
+          f"(median of {args.runs} cold runs)")
+    print(f"{'package':<28} {'self ms':>8}")
+    for name, ms in list(report["packages_ms"].items())[:args.top]:
+        print(f"{name:<28} {ms:>8}")
+
+    failures: List[str] = []
+    if deferred:
+        failures.append("deferred modules imported at startup: " + ", ".join(deferred[:10]))
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures += compare(
+            report["results"], baseline["results"], args.tolerance,
+            compared=(("import_ms", -1), ("create_app_ms", -1)),
+        )
+    for line in failures:
+        print(f"REGRESSION {line}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
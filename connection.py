@@ -1,28 +1,291 @@
 # connection.py
+import asyncio
+import gc
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import compress, count, repeat
+from operator import attrgetter, eq
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from metrics import cache_hit
+from records import SubscriptionRecord, encode_id, prefix_bounds
+
+# Champs indexés par table de hachage (valeur -> positions triées, array('q'))
+HASH_INDEXED_FIELDS = ('status', 'category', 'currency')
+
+# start_date absent : trié en tête
+_NO_DATE = -(1 << 63)
+
+# Reconstruction en bloc d'un index haché : un passage par valeur distincte
+# jusqu'à ce seuil, sinon une boucle classique.
+_BULK_DISTINCT_MAX = 64
+
+def freeze(sub: Union[Dict, SubscriptionRecord]) -> SubscriptionRecord:
+    """Enregistrement compact en lecture seule ; jamais modifié ensuite."""
+    if type(sub) is SubscriptionRecord:
+        return sub
+    return SubscriptionRecord(sub)
+
+class Snapshot(NamedTuple):
+    """Vue cohérente et immuable du store à une version donnée."""
+    version: int
+    records: Tuple[SubscriptionRecord, ...]
 
 class DatabaseManager:
+    """
+    Store en mémoire. Les lectures passent par des snapshots immuables (tuple
+    d'enregistrements figés) republiés après écriture : pas de copie par lecture,
+    pas de lecture déchirée. Les écritures sont sérialisées par un asyncio.Lock.
+
+    Les index référencent la position de l'enregistrement dans _subs (stable :
+    une mise à jour remplace l'enregistrement sur place).
+    """
     def __init__(self):
-        self._subs: List[Dict] = []
+        self._subs: List[SubscriptionRecord] = []
+        self._pos: Dict[Any, int] = {}
+        # (start, position) trié, en deux colonnes -> requêtes par plage via bisect
+        self._start_keys = array('q')
+        self._start_pos = array('q')
+        # valeur -> positions triées, array('q') : 8 octets par entrée, sans objet int
+        self._hash_index: Dict[str, Dict[str, array]] = {
+            field: {} for field in HASH_INDEXED_FIELDS
+        }
+        self._version = 0
+        self._published = Snapshot(0, ())
+        self._lock = asyncio.Lock()
+        # Suivi des ids modifiés, pour un store persistant en write-through
+        self.track_changes = False
+        self._changes: Dict[Any, None] = {}
 
-    async def add_subscription(self, sub: Dict) -> None:
-        if 'id' not in sub:
+    # ----------------------------------------------------------------
+    # Index helpers
+    # ----------------------------------------------------------------
+    def _index(self, record: SubscriptionRecord, pos: int) -> None:
+        start = _NO_DATE if record.start is None else record.start
+        i = bisect_right(self._start_keys, start)
+        self._start_keys.insert(i, start)
+        self._start_pos.insert(i, pos)
+        for field in HASH_INDEXED_FIELDS:
+            value = getattr(record, field)
+            if value is None:
+                continue
+            bucket = self._hash_index[field].get(value)
+            if bucket is None:
+                self._hash_index[field][value] = array('q', (pos,))
+            elif bucket[-1] < pos:
+                bucket.append(pos)
+            else:
+                insort(bucket, pos)  # mise à jour sur place d'une position existante
+
+    def _unindex(self, record: SubscriptionRecord, pos: int) -> None:
+        start = _NO_DATE if record.start is None else record.start
+        lo = bisect_left(self._start_keys, start)
+        hi = bisect_right(self._start_keys, start)
+        for i in range(lo, hi):
+            if self._start_pos[i] == pos:
+                del self._start_keys[i]
+                del self._start_pos[i]
+                break
+        for field in HASH_INDEXED_FIELDS:
+            value = getattr(record, field)
+            bucket = self._hash_index[field].get(value)
+            if bucket is not None:
+                i = bisect_left(bucket, pos)
+                if i < len(bucket) and bucket[i] == pos:
+                    del bucket[i]
+                if not bucket:
+                    del self._hash_index[field][value]
+
+    def _rebuild_indexes(self) -> None:
+        """
+        Reconstruction en bloc de tous les index : un tri unique pour start_date,
+        et pour chaque champ haché un passage par valeur distincte (boucle en C)
+        tant qu'elles sont peu nombreuses.
+        """
+        keys = [_NO_DATE if r.start is None else r.start for r in self._subs]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._start_pos = array('q', order)
+        self._start_keys = array('q', [keys[p] for p in order])
+
+        for field in HASH_INDEXED_FIELDS:
+            values = list(map(attrgetter(field), self._subs))
+            distinct = set(values)
+            distinct.discard(None)
+            index: Dict[Any, array] = {}
+            if len(distinct) <= _BULK_DISTINCT_MAX:
+                for value in distinct:
+                    index[value] = array('q', compress(count(), map(eq, values, repeat(value))))
+            else:
+                for pos, value in enumerate(values):
+                    if value is not None:
+                        bucket = index.get(value)
+                        if bucket is None:
+                            bucket = index[value] = array('q')
+                        bucket.append(pos)
+            self._hash_index[field] = index
+
+    def _range_bounds(self, start_date: Optional[str], end_date: Optional[str]) -> Tuple[int, int]:
+        """
+        Bornes (µs, incluses) sur start_date. Les bornes sont des préfixes ISO :
+        "2025-01" ou "2025-01-31" couvrent tout le mois / jour.
+        """
+        lo = prefix_bounds(start_date)[0] if start_date else _NO_DATE + 1
+        hi = prefix_bounds(end_date)[1] if end_date else (1 << 63) - 1
+        return lo, hi
+
+    def _range_positions(self, lo: int, hi: int) -> List[int]:
+        i = bisect_left(self._start_keys, lo)
+        j = bisect_right(self._start_keys, hi)
+        return list(self._start_pos[i:j])
+
+    def _append(self, sub: Union[Dict, SubscriptionRecord], index: bool = True) -> None:
+        if type(sub) is not SubscriptionRecord and 'id' not in sub:
             sub['id'] = f"sub_{len(self._subs)+1}"
-        self._subs.append(sub)
+        record = freeze(sub)
+        pos = len(self._subs)
+        self._pos[record.key] = pos
+        self._subs.append(record)
+        if index:
+            self._index(record, pos)
+        if self.track_changes:
+            self._changes[record.key] = None
+
+    # ----------------------------------------------------------------
+    # API
+    # ----------------------------------------------------------------
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def snapshot(self) -> Snapshot:
+        """
+        Snapshot courant. Le tuple n'est reconstruit qu'à la première lecture
+        suivant une écriture ; les lectures suivantes le partagent tel quel.
+        """
+        stale = self._published.version != self._version
+        cache_hit("snapshot", not stale)
+        if stale:
+            # Pas d'await : la publication est atomique vis-à-vis de la boucle.
+            self._published = Snapshot(self._version, tuple(self._subs))
+        return self._published
+
+    async def add_subscription(self, sub: Dict) -> None:
+        async with self._lock:
+            self._append(sub)
+            self._version += 1
+
+    async def add_subscriptions(self, subs: Iterable[Dict]) -> None:
+        """
+        Insertion groupée : une seule nouvelle version pour tout le lot, et
+        les index (start_date, hachages) sont reconstruits une fois à la fin.
+        """
+        async with self._lock:
+            self.bulk_load(subs)
+
+    def bulk_load(self, subs: Iterable[Union[Dict, SubscriptionRecord]]) -> None:
+        """
+        Corps de add_subscriptions, sans verrou : utilisable directement sur un
+        store pas encore partagé (chargement d'un tenant, restauration d'un
+        snapshot dans un thread). Les enregistrements déjà figés sont repris tels quels.
+        """
+        # Des millions d'objets sans cycle : le GC n'a rien à collecter mais
+        # parcourrait tout le tas à chaque passe de génération 2.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for sub in subs:
+                self._append(sub, index=False)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self._rebuild_indexes()
+        self._version += 1
 
-    async def get_all_subscriptions(self) -> List[Dict]:
-        return list(self._subs)
+    def drain_changes(self) -> List[SubscriptionRecord]:
+        """Enregistrements ajoutés / modifiés depuis le dernier appel."""
+        changed = [self._subs[self._pos[key]] for key in self._changes]
+        self._changes = {}
+        return changed
 
-    async def get_subscription(self, subscription_id: str) -> Optional[Dict]:
+    async def get_all_subscriptions(self) -> Tuple[SubscriptionRecord, ...]:
+        return self.snapshot().records
+
+    async def query_subscriptions(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        status: Optional[str] = None,
+        category: Optional[str] = None,
+        currency: Optional[str] = None,
+    ) -> Sequence[SubscriptionRecord]:
+        """
+        Abonnements filtrés via les index : seules les lignes candidates sont lues.
+        Sans filtre, renvoie le snapshot courant tel quel (aucune copie).
+        Avec une plage de dates, le résultat est trié par start_date.
+        """
+        filters = {'status': status, 'category': category, 'currency': currency}
+        filters = {k: v for k, v in filters.items() if v is not None}
+        has_range = start_date is not None or end_date is not None
+        if not filters and not has_range:
+            return self.snapshot().records
+
+        # Candidat le plus sélectif parmi les index de hachage
+        candidates: Optional[array] = None
+        driving_field = None
+        for field, value in filters.items():
+            bucket = self._hash_index[field].get(value)
+            if not bucket:
+                return []
+            if candidates is None or len(bucket) < len(candidates):
+                candidates, driving_field = bucket, field
+
+        if has_range:
+            lo, hi = self._range_bounds(start_date, end_date)
+            range_positions = self._range_positions(lo, hi)
+            if candidates is None or len(range_positions) <= len(candidates):
+                positions = range_positions
+                driving_field = None
+            else:
+                subs = self._subs
+                positions = [
+                    p for p in candidates
+                    if subs[p].start is not None and lo <= subs[p].start <= hi
+                ]
+                positions.sort(key=lambda p: subs[p].start)
+        else:
+            positions = list(candidates)
+
+        remaining = [(k, v) for k, v in filters.items() if k != driving_field]
+        result = []
+        for p in positions:
+            record = self._subs[p]
+            if all(getattr(record, k) == v for k, v in remaining):
+                result.append(record)
+        return result
+
+    async def get_subscription(self, subscription_id: str) -> Optional[SubscriptionRecord]:
+        pos = self._pos.get(encode_id(subscription_id))
+        if pos is not None:
+            return self._subs[pos]
         for s in self._subs:
-            if s.get('id') == subscription_id or s.get('name','').lower() == subscription_id.lower():
+            if (s.name or '').lower() == subscription_id.lower():
                 return s
         return None
 
     async def update_subscription(self, subscription_id: str, patch: Dict) -> None:
-        for s in self._subs:
-            if s.get('id') == subscription_id or s.get('name','').lower() == subscription_id.lower():
-                s.update(patch)
-                s.setdefault('updated_at', datetime.now().isoformat())
+        async with self._lock:
+            old = await self.get_subscription(subscription_id)
+            if old is None:
                 return
+            # Nouvel enregistrement : les snapshots déjà publiés gardent l'ancien.
+            if 'updated_at' not in patch and old.updated is None:
+                patch = {**patch, 'updated_at': datetime.now().isoformat()}
+            record = old.replace(patch)
+            pos = self._pos[old.key]
+            self._unindex(old, pos)
+            self._subs[pos] = record
+            self._index(record, pos)
+            if self.track_changes:
+                self._changes[record.key] = None
+            self._version += 1
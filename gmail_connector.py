@@ -1,8 +1,7 @@
 import os
 import pickle
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+
+from gmail_scheduler import scheduler_for
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
@@ -11,8 +10,13 @@ class GmailConnector:
         self.client_secret_file = client_secret_file
         self.token_file = token_file
         self.creds = None
+        self.failed = []  # (id, erreur) des messages non lus au dernier fetch_emails
 
     def authenticate(self):
+        # Pile Google importée à l'usage : importer ce module reste léger.
+        from google.auth.transport.requests import Request
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         if os.path.exists(self.token_file):
             with open(self.token_file, "rb") as token:
                 self.creds = pickle.load(token)
@@ -30,14 +34,26 @@ class GmailConnector:
                 pickle.dump(self.creds, token)
 
     def fetch_emails(self, query="subject:(receipt OR invoice OR subscription OR payment) newer_than:365d", max_results=20):
+        from googleapiclient.discovery import build
+
+        # Quota, concurrence et reprises partagés avec les scans du serveur pour ce compte
+        scheduler = scheduler_for(self.token_file)
         service = build("gmail", "v1", credentials=self.creds)
-        results = service.users().messages().list(
+        results = scheduler.execute_sync("list", service.users().messages().list(
             userId="me", q=query, maxResults=max_results
-        ).execute()
+        ).execute)
         messages = results.get("messages", [])
         emails = []
+        self.failed = []
         for msg in messages:
-            full_msg = service.users().messages().get(userId="me", id=msg["id"]).execute()
+            try:
+                full_msg = scheduler.execute_sync(
+                    "get", service.users().messages().get(userId="me", id=msg["id"]).execute
+                )
+            except Exception as e:
+                # reprises épuisées : on garde les e-mails déjà lus
+                self.failed.append((msg["id"], str(e)))
+                continue
             snippet = full_msg.get("snippet", "")
             emails.append(snippet)
         return emails
@@ -0,0 +1,285 @@
+# gmail_scheduler.py
+"""
+Ordonnanceur des appels à l'API Gmail, partagé par tous les scans d'un même
+compte (le quota Gmail est par utilisateur) et par GmailConnector :
+
+- seau à jetons en unités de quota (messages.list / messages.get = 5 unités,
+  250 unités/s par utilisateur) ;
+- AIMD sur les limitations (429) : la concurrence et le débit du seau sont
+  divisés par deux, une fois par épisode (seuls les appels partis depuis la
+  dernière réduction en déclenchent une nouvelle), puis remontent
+  additivement à chaque succès (+1 appel simultané par fenêtre, +coût de
+  l'appel en unités/s) jusqu'aux plafonds configurés ;
+- nouvelles tentatives avec backoff exponentiel à jitter complet sur les
+  erreurs transitoires (429, 5xx, 403 de quota, coupures réseau), en
+  respectant Retry-After.
+
+Utilisable depuis asyncio (execute) comme depuis du code bloquant
+(execute_sync) : l'état est protégé par un threading.Lock.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+from metrics import GMAIL_CALLS, GMAIL_RETRIES, GMAIL_WAIT
+
+log = logging.getLogger("subscription-http.gmail")
+
+T = TypeVar("T")
+
+# Coût des méthodes en unités de quota (documentation de l'API Gmail)
+QUOTA_UNITS = {"list": 5, "get": 5, "history": 2, "threads.get": 10}
+DEFAULT_UNITS = 5
+
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+# Gmail signale aussi les dépassements de quota par un 403
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+def http_status(error: BaseException) -> Optional[int]:
+    """Statut HTTP d'une googleapiclient.errors.HttpError (lue sans l'importer)."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_throttled(error: BaseException) -> bool:
+    status = http_status(error)
+    if status == 429:
+        return True
+    if status == 403:
+        content = getattr(error, "content", b"") or b""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", errors="ignore")
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+def is_transient(error: BaseException) -> bool:
+    """Erreur qui peut réussir à la tentative suivante."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return http_status(error) in TRANSIENT_STATUS or is_throttled(error)
+
+def retry_after(error: BaseException) -> Optional[float]:
+    resp = getattr(error, "resp", None)
+    value = resp.get("retry-after") if isinstance(resp, dict) else None
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None  # forme date HTTP : ignorée, le backoff s'applique
+
+def _resolve(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(None)
+
+class GmailScheduler:
+    """
+    units_per_second: débit maximal du seau à jetons (0 = pas de limite) ;
+      burst_seconds: capacité du seau, en secondes de débit
+    max_concurrency: plafond AIMD des appels simultanés
+    max_retries / base_delay / max_delay: reprises des erreurs transitoires
+    """
+    def __init__(
+        self,
+        units_per_second: float = 250.0,
+        burst_seconds: float = 1.0,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 32.0,
+        decrease_factor: float = 0.5,
+    ):
+        self.rate = units_per_second
+        self.capacity = units_per_second * burst_seconds
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decrease_factor = decrease_factor
+        self._rate = units_per_second
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._limit = float(max(1, self.max_concurrency // 2))
+        self._in_flight = 0
+        self._waiters: Deque[Callable[[], None]] = deque()
+        self._epoch = 0  # incrémenté à chaque réduction
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls) -> "GmailScheduler":
+        return cls(
+            units_per_second=float(os.environ.get("GMAIL_QUOTA_UNITS_PER_SECOND", "250")),
+            max_concurrency=int(os.environ.get("GMAIL_MAX_CONCURRENCY", "8")),
+            max_retries=int(os.environ.get("GMAIL_MAX_RETRIES", "5")),
+        )
+
+    @property
+    def concurrency(self) -> int:
+        """Nombre d'appels simultanés autorisés en ce moment."""
+        return int(self._limit)
+
+    def state(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency": int(self._limit),
+                "in_flight": self._in_flight,
+                "units_per_second": round(self._rate, 1),
+                "tokens": round(self._tokens, 1),
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+    # -- seau à jetons ------------------------------------------------
+    def _reserve(self, units: float) -> float:
+        """Prélève units (le solde peut devenir négatif) et renvoie l'attente nécessaire."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= units
+            return max(0.0, -self._tokens / self._rate)
+
+    # -- concurrence AIMD ---------------------------------------------
+    def _try_enter(self, wake: Callable[[], None]) -> Optional[int]:
+        """Époque courante si une place est prise, sinon None (wake sera appelé)."""
+        with self._lock:
+            if self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return self._epoch
+            self._waiters.append(wake)
+            return None
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            waiters, self._waiters = self._waiters, deque()
+        # Tous réveillés : ceux qui n'obtiennent pas de place se réinscrivent.
+        for wake in waiters:
+            try:
+                wake()
+            except RuntimeError:
+                pass  # boucle asyncio fermée entre-temps
+
+    async def _enter(self) -> int:
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            epoch = self._try_enter(lambda: loop.call_soon_threadsafe(_resolve, future))
+            if epoch is not None:
+                return epoch
+            await future
+
+    def _enter_sync(self) -> int:
+        while True:
+            event = threading.Event()
+            epoch = self._try_enter(event.set)
+            if epoch is not None:
+                return epoch
+            event.wait()
+
+    def _on_success(self, units: float) -> None:
+        with self._lock:
+            self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+            if self.rate > 0:
+                self._rate = min(self.rate, self._rate + units)
+
+    def _on_throttle(self, epoch: int) -> None:
+        with self._lock:
+            self.throttled += 1
+            if epoch != self._epoch:
+                return  # appel parti avant la dernière réduction : même épisode
+            self._epoch += 1
+            self._limit = max(1.0, self._limit * self.decrease_factor)
+            if self.rate > 0:
+                self._rate = max(float(DEFAULT_UNITS), self._rate * self.decrease_factor)
+                # Le seau repart à vide : le quota côté Gmail se reconstitue.
+                self._tokens = min(self._tokens, 0.0)
+            limit, rate = self._limit, self._rate
+        log.info("gmail throttled, concurrency down to %d, %.0f units/s", int(limit), rate)
+
+    def _retry_delay(self, method: str, attempt: int, error: Exception, epoch: int) -> Optional[float]:
+        """Attente avant la tentative suivante, ou None si l'erreur doit remonter."""
+        if is_throttled(error):
+            self._on_throttle(epoch)
+        if not is_transient(error) or attempt >= self.max_retries:
+            return None
+        with self._lock:
+            self.retries += 1
+        GMAIL_RETRIES.inc(method, str(http_status(error) or type(error).__name__))
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = retry_after(error)
+        return max(delay, hint) if hint is not None else delay
+
+    # -- exécution ----------------------------------------------------
+    async def execute(self, method: str, call: Callable[[], T]) -> T:
+        """
+        call() est l'appel bloquant (request.execute), lancé dans un thread
+        une fois le quota et une place de concurrence obtenus.
+        """
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        attempt = 0
+        while True:
+            wait = self._reserve(units)
+            if wait:
+                GMAIL_WAIT.observe(wait)
+                await asyncio.sleep(wait)
+            epoch = await self._enter()
+            GMAIL_CALLS.inc(method)
+            try:
+                result = await asyncio.to_thread(call)
+            except Exception as e:
+                delay = self._retry_delay(method, attempt, e, epoch)
+                if delay is None:
+                    raise
+            else:
+                self._on_success(units)
+                return result
+            finally:
+                self._leave()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def execute_sync(self, method: str, call: Callable[[], T]) -> T:
+        """Équivalent bloquant de execute(), pour le code hors asyncio."""
+        units = QUOTA_UNITS.get(method, DEFAULT_UNITS)
+        attempt = 0
+        while True:
+            wait = self._reserve(units)
+            if wait:
+                GMAIL_WAIT.observe(wait)
+                time.sleep(wait)
+            epoch = self._enter_sync()
+            GMAIL_CALLS.inc(method)
+            try:
+                result = call()
+            except Exception as e:
+                delay = self._retry_delay(method, attempt, e, epoch)
+                if delay is None:
+                    raise
+            else:
+                self._on_success(units)
+                return result
+            finally:
+                self._leave()
+            attempt += 1
+            time.sleep(delay)
+
+# Un ordonnanceur par compte Gmail (clé : fichier de token), créé à la demande
+SCHEDULERS: Dict[str, GmailScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def scheduler_for(account: str) -> GmailScheduler:
+    with _schedulers_lock:
+        scheduler = SCHEDULERS.get(account)
+        if scheduler is None:
+            scheduler = SCHEDULERS[account] = GmailScheduler.from_env()
+        return scheduler
@@ -0,0 +1,342 @@
+# jobs.py
+import asyncio
+import logging
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from metrics import cache_hit
+
+log = logging.getLogger("subscription-http.jobs")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class ScanJob:
+    """État d'un scan en arrière-plan, lu par get_scan_status."""
+    def __init__(self, tenant: str, source: str, run: Callable[["ScanJob"], Awaitable[List[Dict]]]):
+        self.id = f"scan_{uuid.uuid4().hex[:12]}"
+        self.tenant = tenant
+        self.source = source
+        self.run = run
+        self.status = QUEUED
+        self.done = 0
+        self.total: Optional[int] = None
+        self.found = 0
+        self.errors: List[str] = []
+        self.result: Optional[List[Dict]] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._on_change: Optional[Callable[["ScanJob", bool], None]] = None
+
+    def update(self, done: Optional[int] = None, total: Optional[int] = None, found: Optional[int] = None) -> None:
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if found is not None:
+            self.found = found
+        self._notify()
+
+    def _notify(self, force: bool = False) -> None:
+        # Réveille les attentes en cours ; les suivantes attendent le prochain changement.
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if self._on_change is not None:
+            self._on_change(self, force)
+
+    async def wait_changed(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "subscriptions_found": self.found,
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class RemoteScanJob:
+    """
+    Job exécuté par un autre worker : état relu depuis le store partagé.
+    Les résultats restent dans la mémoire du worker qui l'exécute (result=None).
+    """
+    def __init__(self, state, tenant: str, data: Dict[str, Any]):
+        self._state = state
+        self.tenant = tenant
+        self.result: Optional[List[Dict]] = None
+        self._apply(data)
+
+    def _apply(self, data: Dict[str, Any]) -> None:
+        self._data = data
+        self.id = data["job_id"]
+        self.source = data["source"]
+        self.status = data["status"]
+        self.done = data["progress"]["done"]
+        self.total = data["progress"]["total"]
+        self.found = data["subscriptions_found"]
+        self.errors = data["errors"]
+
+    async def wait_changed(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+            data = await asyncio.to_thread(self._state.load_job, self.tenant, self.id)
+            if data is not None and data != self._data:
+                self._apply(data)
+                return True
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+class ScanJobManager:
+    """
+    File bornée + pool de workers asyncio pour les scans longs (Gmail, gros CSV).
+    Les workers démarrent au premier submit (il faut une boucle en cours).
+
+    Avec un state partagé (SQLiteTenantStore), l'état des jobs y est publié
+    (au plus une fois par publish_interval, plus chaque changement de statut) :
+    get / cancel fonctionnent alors depuis n'importe quel worker. Les accès au
+    state (bloquants, jusqu'au timeout SQLite) passent par asyncio.to_thread.
+    """
+    def __init__(
+        self,
+        workers: int = 2,
+        max_queued: int = 100,
+        keep_finished: int = 1000,
+        state=None,
+        publish_interval: float = 1.0,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished = keep_finished
+        self.state = state
+        self.publish_interval = publish_interval
+        self._jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._published: Dict[str, float] = {}
+        self._unsaved: Dict[str, Dict[str, Any]] = {}  # job -> dernier état à publier
+        self._background: Set[asyncio.Task] = set()
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_queued)
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, tenant: str, source: str, run: Callable[[ScanJob], Awaitable[List[Dict]]]) -> ScanJob:
+        """Lève asyncio.QueueFull si trop de scans sont déjà en attente."""
+        self._ensure_started()
+        job = ScanJob(tenant, source, run)
+        self._queue.put_nowait(job)
+        self._jobs[job.id] = job
+        if self.state is not None:
+            job._on_change = self._publish
+            self._publish(job, True)
+        self._prune()
+        return job
+
+    def _publish(self, job: ScanJob, force: bool) -> None:
+        now = time.monotonic()
+        if not force and now - self._published.get(job.id, 0.0) < self.publish_interval:
+            return
+        self._published[job.id] = now
+        # Un seul écrivain par job : les états sont écrits dans l'ordre, et
+        # ceux arrivés pendant une écriture sont fusionnés dans la suivante.
+        writing = job.id in self._unsaved
+        self._unsaved[job.id] = job.to_dict()
+        if not writing:
+            self._spawn(self._write_job(job))
+
+    async def _write_job(self, job: ScanJob) -> None:
+        while job.id in self._unsaved:
+            data = self._unsaved[job.id]
+            try:
+                cancel_requested = await asyncio.to_thread(self.state.save_job, job.tenant, data)
+            except Exception:
+                log.exception("could not publish scan job %s", job.id)
+                cancel_requested = False
+            if self._unsaved.get(job.id) is data:
+                del self._unsaved[job.id]
+            if cancel_requested and job.status not in FINISHED:
+                await self.cancel(job.id, job.tenant)
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def get(self, job_id: str, tenant: str) -> Optional[Union[ScanJob, RemoteScanJob]]:
+        job = self._jobs.get(job_id)
+        # Un tenant ne voit que ses propres jobs.
+        if job is not None:
+            return job if job.tenant == tenant else None
+        if self.state is not None:
+            data = await asyncio.to_thread(self.state.load_job, tenant, job_id)
+            if data is not None:
+                return RemoteScanJob(self.state, tenant, data)
+        return None
+
+    async def cancel(self, job_id: str, tenant: str) -> Optional[Union[ScanJob, RemoteScanJob]]:
+        job = await self.get(job_id, tenant)
+        if isinstance(job, RemoteScanJob):
+            # Le worker propriétaire verra la demande à sa prochaine publication.
+            if job.status not in FINISHED:
+                await asyncio.to_thread(self.state.request_cancel, tenant, job_id)
+            return job
+        if job is None or job.status in FINISHED:
+            return job
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            # Encore en file : le worker l'ignorera.
+            self._finish(job, CANCELLED)
+        return job
+
+    def _finish(self, job: ScanJob, status: str) -> None:
+        job.status = status
+        job.finished_at = datetime.now().isoformat()
+        job._notify(force=True)
+        self._published.pop(job.id, None)
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.status in FINISHED]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+        if self.state is not None and len(finished) > self.keep_finished:
+            self._spawn(self._prune_state())
+
+    async def _prune_state(self) -> None:
+        try:
+            await asyncio.to_thread(self.state.prune_jobs, older_than_seconds=86400)
+        except Exception:
+            log.exception("could not prune scan jobs")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started_at = datetime.now().isoformat()
+                job._notify(force=True)
+                started = time.perf_counter()
+                job.task = asyncio.create_task(job.run(job))
+                try:
+                    job.result = await job.task
+                    self._finish(job, DONE)
+                except asyncio.CancelledError:
+                    self._finish(job, CANCELLED)
+                    if asyncio.current_task().cancelling():
+                        raise  # arrêt du worker lui-même
+                except Exception as e:
+                    log.exception("scan job %s failed", job.id)
+                    job.errors.append(str(e))
+                    self._finish(job, FAILED)
+                log.info("scan job %s %s in %.2fs", job.id, job.status, time.perf_counter() - started)
+            finally:
+                self._queue.task_done()
+
+    async def stop(self) -> None:
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Derniers états (jobs annulés) publiés avant l'arrêt
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+class ScanCheckpoint:
+    """Avancement d'un scan Gmail : messages listés, messages traités, abonnements trouvés."""
+    def __init__(self, message_ids: List[str]):
+        self.message_ids = message_ids
+        self.done: Set[str] = set()
+        self.fetching: Set[str] = set()  # réclamés par un fetcher, en cours
+        self.found: Dict[str, Dict] = {}  # id du message -> abonnement parsé
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def claim(self, message_id: str) -> None:
+        self.fetching.add(message_id)
+        self._idle.clear()
+
+    def release(self, message_id: str) -> None:
+        self.fetching.discard(message_id)
+        if not self.fetching:
+            self._idle.set()
+
+    async def settled(self) -> None:
+        """Attend la fin des messages en cours (dans ce scan ou un scan identique)."""
+        await self._idle.wait()
+
+    @property
+    def pending(self) -> List[str]:
+        return [m for m in self.message_ids if m not in self.done]
+
+    def results(self) -> List[Dict]:
+        """Abonnements trouvés, dans l'ordre de la liste Gmail."""
+        return [self.found[m] for m in self.message_ids if m in self.found]
+
+class ScanCheckpoints:
+    """
+    Points de reprise des scans interrompus, par tenant et paramètres du scan :
+    relancer le même scan reprend là où il s'est arrêté, sans relire ni
+    réenregistrer les messages déjà traités. En mémoire du worker (comme les
+    résultats des jobs), expirés après ttl_seconds.
+
+    lock() sérialise la création d'un point de reprise : deux scans identiques
+    simultanés partagent la même liste et se répartissent les messages.
+    """
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, ScanCheckpoint]]" = OrderedDict()
+        # libérés avec le dernier scan qui les tient
+        self._locks: "weakref.WeakValueDictionary[Tuple[str, str], asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            key, (created, _) = next(iter(self._entries.items()))
+            if now - created < self.ttl_seconds and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def lock(self, tenant: str, key: str) -> asyncio.Lock:
+        lock = self._locks.get((tenant, key))
+        if lock is None:
+            lock = self._locks[(tenant, key)] = asyncio.Lock()
+        return lock
+
+    def get(self, tenant: str, key: str) -> Optional[ScanCheckpoint]:
+        self._expire()
+        entry = self._entries.get((tenant, key))
+        cache_hit("scan_checkpoint", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, tenant: str, key: str, checkpoint: ScanCheckpoint) -> None:
+        self._entries[(tenant, key)] = (time.monotonic(), checkpoint)
+        self._expire()
+
+    def drop(self, tenant: str, key: str) -> None:
+        self._entries.pop((tenant, key), None)
@@ -0,0 +1,221 @@
+# metrics.py
+"""
+Métriques au format texte Prometheus (sans dépendance) + profilage des appels lents.
+
+Les compteurs sont par process : en mode multi-workers, chaque worker expose
+les siens sur /metrics.
+"""
+import asyncio
+import bisect
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("subscription-http.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = ()):
+        self.name, self.doc = name, doc
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()  # incrémenté aussi depuis asyncio.to_thread
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {float(value)!r}")
+        return lines
+
+class Histogram:
+    def __init__(
+        self, name: str, doc: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        self.name, self.doc = name, doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        # labels -> [compteurs par bucket..., +Inf], somme
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            counts, total = self._values.setdefault(labels, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {float(total[0])!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+# --------------------------------------------------------------------
+# Registre
+# --------------------------------------------------------------------
+TOOL_CALLS = Counter("mcp_tool_calls_total", "Appels d'outils MCP.", ["tool"])
+TOOL_ERRORS = Counter("mcp_tool_errors_total", "Appels en échec (exception ou success=false).", ["tool"])
+TOOL_LATENCY = Histogram("mcp_tool_latency_seconds", "Durée des appels d'outils MCP.", ["tool"])
+GMAIL_CALLS = Counter("gmail_api_calls_total", "Appels à l'API Gmail.", ["method"])
+GMAIL_BYTES = Counter("gmail_api_bytes_total", "Taille des messages Gmail récupérés (sizeEstimate).")
+GMAIL_RETRIES = Counter("gmail_api_retries_total", "Nouvelles tentatives après une erreur transitoire.", ["method", "status"])
+GMAIL_WAIT = Histogram("gmail_quota_wait_seconds", "Attente imposée par le seau à jetons du quota Gmail.")
+PARSER_ITEMS = Counter("parser_items_total", "Entrées traitées par les parseurs.", ["parser"])
+PARSER_SECONDS = Counter("parser_seconds_total", "Temps passé dans les parseurs.", ["parser"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Accès aux caches.", ["cache", "result"])
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "Retard de réveil de la boucle asyncio.", buckets=LAG_BUCKETS)
+
+REGISTRY = [
+    TOOL_CALLS, TOOL_ERRORS, TOOL_LATENCY,
+    GMAIL_CALLS, GMAIL_BYTES, GMAIL_RETRIES, GMAIL_WAIT,
+    PARSER_ITEMS, PARSER_SECONDS,
+    CACHE_REQUESTS,
+    EVENT_LOOP_LAG,
+]
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def cache_hit(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+class timed_parser:
+    """with timed_parser("email") as t: ... ; t.items = n"""
+    def __init__(self, parser: str):
+        self.parser = parser
+        self.items = 1
+
+    def __enter__(self) -> "timed_parser":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        PARSER_SECONDS.inc(self.parser, amount=time.perf_counter() - self._start)
+        PARSER_ITEMS.inc(self.parser, amount=self.items)
+
+async def monitor_event_loop(interval: float = 0.1) -> None:
+    """
+    Mesure en continu le retard de la boucle : un sleep(interval) qui se
+    réveille en retard signifie qu'un callback a bloqué la boucle entre-temps.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+# --------------------------------------------------------------------
+# Profilage des appels lents
+# --------------------------------------------------------------------
+class SlowCallProfiler:
+    """
+    Activé par PROFILE_SLOW_MS : une fraction (PROFILE_SAMPLE_RATE) des appels
+    est profilée avec cProfile, et le profil est écrit dans PROFILE_DIR si
+    l'appel dépasse le seuil (lisible avec `python -m pstats` ou snakeviz).
+
+    cProfile voit tout ce qui tourne sur la boucle pendant l'appel, y compris
+    les autres requêtes : un seul appel est profilé à la fois.
+    """
+    def __init__(self, slow_ms: Optional[float], directory: str = "profiles", sample_rate: float = 1.0):
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._active = False
+        self._seq = itertools.count(1)
+
+    @classmethod
+    def from_env(cls) -> "SlowCallProfiler":
+        slow_ms = os.environ.get("PROFILE_SLOW_MS")
+        return cls(
+            float(slow_ms) if slow_ms else None,
+            os.environ.get("PROFILE_DIR", "profiles"),
+            float(os.environ.get("PROFILE_SAMPLE_RATE", "1.0")),
+        )
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if self.slow_ms is None or self._active or random.random() >= self.sample_rate:
+            return None
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, tool: str, elapsed: float) -> None:
+        profile.disable()
+        self._active = False
+        if elapsed * 1000 < self.slow_ms:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory, f"{tool}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._seq)}"
+                f"-{elapsed * 1000:.0f}ms.prof"
+            )
+            profile.dump_stats(path)
+            log.info("slow call %s (%.0f ms) profiled to %s", tool, elapsed * 1000, path)
+        except OSError:
+            log.exception("could not write profile for %s", tool)
+
+PROFILER = SlowCallProfiler.from_env()
+
+def instrument_tool(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Décorateur à placer sous @mcp.tool() : compte, chronomètre et profile l'outil.
+    functools.wraps garde la signature lue par FastMCP (paramètres, Context).
+    """
+    tool = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        TOOL_CALLS.inc(tool)
+        profile = PROFILER.start()
+        start = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            TOOL_ERRORS.inc(tool)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            TOOL_LATENCY.observe(elapsed, tool)
+            if profile is not None:
+                PROFILER.stop(profile, tool, elapsed)
+        if isinstance(result, dict) and result.get("success") is False:
+            TOOL_ERRORS.inc(tool)
+        return result
+
+    return wrapper
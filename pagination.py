@@ -0,0 +1,129 @@
+# pagination.py
+import asyncio
+import base64
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from metrics import cache_hit
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class CursorError(ValueError):
+    pass
+
+def encode_cursor(result_id: str, offset: int) -> str:
+    raw = json.dumps({"r": result_id, "o": offset}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(data["r"]), int(data["o"])
+    except Exception:
+        raise CursorError(f"Invalid cursor '{cursor}'")
+
+def project(item: Mapping[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Conversion en dict pour la réponse MCP, limitée aux champs demandés."""
+    if not fields:
+        return item.to_dict() if hasattr(item, "to_dict") else dict(item)
+    return {f: item.get(f) for f in fields if f in item}
+
+class ResultCache:
+    """
+    Résultats figés (tuple de références vers un snapshot du store ou vers la
+    sortie d'un scan) indexés par curseur : les pages suivantes relisent
+    exactement le même ensemble, même si le store a changé entre-temps.
+
+    Avec un state partagé (SQLiteTenantStore), la suite du résultat y est
+    écrite (au premier curseur émis) : un curseur reste valide quel que soit
+    le worker qui reçoit la page suivante.
+    """
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 600.0, state=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.state = state
+        self._entries: "OrderedDict[str, Tuple[str, float, Tuple[Any, ...]]]" = OrderedDict()
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            key, (_, created, _) = next(iter(self._entries.items()))
+            if now - created < self.ttl_seconds and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def put(self, tenant: str, items: Sequence[Any], start: int = 0) -> str:
+        """Enregistre items ; seuls ceux à partir de start seront relus."""
+        result_id = uuid.uuid4().hex[:16]
+        if self.state is not None:
+            rows = [project(i, None) for i in items[start:]]
+            await asyncio.to_thread(
+                self.state.save_result, tenant, result_id, rows, start, len(items), self.ttl_seconds
+            )
+            return result_id
+        self._entries[result_id] = (tenant, time.monotonic(), tuple(items))
+        self._expire()
+        return result_id
+
+    async def get(self, tenant: str, result_id: str, offset: int, end: int) -> Tuple[Sequence[Any], int]:
+        """(items[offset:end], nombre total d'items) du résultat result_id."""
+        if self.state is not None:
+            entry = await asyncio.to_thread(
+                self.state.load_result, tenant, result_id, offset, end, self.ttl_seconds
+            )
+        else:
+            self._expire()
+            entry = self._entries.get(result_id)
+            if entry is not None and entry[0] == tenant:
+                entry = (entry[2][offset:end], len(entry[2]))
+            else:
+                entry = None
+        cache_hit("result_pages", entry is not None)
+        if entry is None:
+            raise CursorError("Cursor expired or unknown, restart without cursor")
+        return entry
+
+    async def first_page(
+        self,
+        tenant: str,
+        items: Sequence[Any],
+        limit: Optional[int],
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Première page ; le reste n'est mis en cache que s'il existe une page suivante.
+        limit=None -> tout, sans curseur (comportement historique).
+        """
+        if limit is None:
+            return {"items": [project(i, fields) for i in items], "next_cursor": None, "total": len(items)}
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        next_cursor = None
+        if len(items) > limit:
+            next_cursor = encode_cursor(await self.put(tenant, items, limit), limit)
+        return {
+            "items": [project(i, fields) for i in items[:limit]],
+            "next_cursor": next_cursor,
+            "total": len(items),
+        }
+
+    async def next_page(
+        self,
+        tenant: str,
+        cursor: str,
+        limit: Optional[int],
+        fields: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        result_id, offset = decode_cursor(cursor)
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        end = offset + limit
+        items, total = await self.get(tenant, result_id, offset, end)
+        return {
+            "items": [project(i, fields) for i in items],
+            "next_cursor": encode_cursor(result_id, end) if end < total else None,
+            "total": total,
+        }
@@ -0,0 +1,200 @@
+# records.py
+import sys
+import uuid
+from collections.abc import Mapping
+from operator import attrgetter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+# Horodatages stockés en microsecondes depuis 1970-01-01 (heure murale, sans fuseau),
+# ce qui restitue exactement les chaînes datetime.now().isoformat() d'origine.
+_EPOCH = datetime(1970, 1, 1)
+_MICRO = timedelta(microseconds=1)
+
+# Champs "dict" -> slot horodatage
+TIMESTAMP_FIELDS = {
+    'start_date': 'start',
+    'created_at': 'created',
+    'updated_at': 'updated',
+    'cancelled_at': 'cancelled',
+}
+STRING_FIELDS = ('name', 'currency', 'billing_cycle', 'category', 'status')
+
+# Les montants se répètent beaucoup (15.99, 9.99...) : un float partagé par valeur.
+_COSTS: Dict[float, float] = {}
+_MAX_INTERNED_COSTS = 65536
+
+def to_epoch(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH) // _MICRO
+
+def from_epoch(value: Optional[int]) -> Optional[str]:
+    if value is None:
+        return None
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+def prefix_bounds(prefix: str) -> "tuple[int, int]":
+    """
+    Bornes [début, fin] (µs, incluses) couvertes par un préfixe ISO :
+    "2025", "2025-01", "2025-01-31" ou une date-heure complète.
+    """
+    if len(prefix) == 4:
+        lo = datetime(int(prefix), 1, 1)
+        hi = datetime(int(prefix) + 1, 1, 1)
+    elif len(prefix) == 7:
+        y, m = int(prefix[:4]), int(prefix[5:7])
+        lo = datetime(y, m, 1)
+        hi = datetime(y + m // 12, m % 12 + 1, 1)
+    elif len(prefix) == 10:
+        lo = datetime.fromisoformat(prefix)
+        hi = lo + timedelta(days=1)
+    else:
+        point = to_epoch(prefix)
+        return point, point
+    return (lo - _EPOCH) // _MICRO, (hi - _EPOCH) // _MICRO - 1
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+def _intern_cost(value: Any) -> Any:
+    if type(value) is not float:
+        return value
+    shared = _COSTS.get(value)
+    if shared is not None:
+        return shared
+    if len(_COSTS) < _MAX_INTERNED_COSTS:
+        _COSTS[value] = value
+    return value
+
+def encode_id(value: str) -> Union[int, str]:
+    """Les ids UUID canoniques sont gardés sous forme d'entier 128 bits."""
+    if len(value) == 36:
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(parsed) == value:
+            return parsed.int
+    return value
+
+def decode_id(value: Union[int, str]) -> str:
+    return str(uuid.UUID(int=value)) if type(value) is int else value
+
+_set = object.__setattr__
+
+class SubscriptionRecord(Mapping):
+    """
+    Abonnement compact et immuable : slots, chaînes internées, horodatages entiers.
+    Se lit comme l'ancien dict (record['start_date'], record.get('cost')) ;
+    to_dict() ne sert qu'en sortie de réponse MCP ou pour la persistance.
+    """
+    __slots__ = (
+        '_id', 'name', 'cost', 'currency', 'billing_cycle', 'category', 'status',
+        'start', 'created', 'updated', 'cancelled', 'extra',
+    )
+
+    def __init__(self, sub: Dict[str, Any]):
+        _set(self, '_id', encode_id(sub['id']))
+        for field in STRING_FIELDS:
+            _set(self, field, _intern(sub.get(field)))
+        _set(self, 'cost', _intern_cost(sub.get('cost')))
+        for field, slot in TIMESTAMP_FIELDS.items():
+            _set(self, slot, to_epoch(sub.get(field)))
+        extra = {
+            k: v for k, v in sub.items()
+            if k != 'id' and k != 'cost' and k not in TIMESTAMP_FIELDS and k not in STRING_FIELDS
+        }
+        _set(self, 'extra', extra or None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SubscriptionRecord is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("SubscriptionRecord is immutable")
+
+    @property
+    def id(self) -> str:
+        return decode_id(self._id)
+
+    @property
+    def key(self) -> Union[int, str]:
+        """Forme compacte de l'id, utilisée comme clé d'index."""
+        return self._id
+
+    # -- interface Mapping (forme dict historique) --------------------
+    def __getitem__(self, field: str) -> Any:
+        if field == 'id':
+            return self.id
+        if field == 'cost' or field in STRING_FIELDS:
+            value = getattr(self, field)
+        elif field in TIMESTAMP_FIELDS:
+            value = from_epoch(getattr(self, TIMESTAMP_FIELDS[field]))
+        elif self.extra is not None and field in self.extra:
+            return self.extra[field]
+        else:
+            raise KeyError(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        yield 'id'
+        for field in ('name', 'cost', 'currency', 'billing_cycle', 'category', 'status'):
+            if getattr(self, field) is not None:
+                yield field
+        for field, slot in TIMESTAMP_FIELDS.items():
+            if getattr(self, slot) is not None:
+                yield field
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"SubscriptionRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: self[field] for field in self}
+
+    # -- forme "ligne" des snapshots : valeurs des slots, déjà encodées ----
+    def to_row(self) -> Tuple[Any, ...]:
+        return _ROW(self)
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "SubscriptionRecord":
+        """Inverse de to_row(), sans reparser les dates (restauration rapide)."""
+        record = _new(cls)
+        _id, name, cost, currency, cycle, category, status, start, created, updated, cancelled, extra = row
+        _SET_ID(record, _id)
+        _SET_NAME(record, _intern(name))
+        _SET_COST(record, _intern_cost(cost))
+        _SET_CURRENCY(record, _intern(currency))
+        _SET_CYCLE(record, _intern(cycle))
+        _SET_CATEGORY(record, _intern(category))
+        _SET_STATUS(record, _intern(status))
+        _SET_START(record, start)
+        _SET_CREATED(record, created)
+        _SET_UPDATED(record, updated)
+        _SET_CANCELLED(record, cancelled)
+        _SET_EXTRA(record, extra)
+        return record
+
+    def replace(self, patch: Dict[str, Any]) -> "SubscriptionRecord":
+        updated = self.to_dict()
+        updated.update(patch)
+        updated['id'] = self.id
+        return SubscriptionRecord(updated)
+
+# Accès directs aux slots (descripteurs), sans passer par __setattr__ : from_row
+# est le chemin chaud de la restauration d'un snapshot.
+_new = object.__new__
+_ROW = attrgetter(*SubscriptionRecord.__slots__)
+(
+    _SET_ID, _SET_NAME, _SET_COST, _SET_CURRENCY, _SET_CYCLE, _SET_CATEGORY, _SET_STATUS,
+    _SET_START, _SET_CREATED, _SET_UPDATED, _SET_CANCELLED, _SET_EXTRA,
+) = (SubscriptionRecord.__dict__[slot].__set__ for slot in SubscriptionRecord.__slots__)
@@ -2,28 +2,40 @@
 # mcp.run(transport='streamable-http')
 # run_http.py
 
+import hmac
+import importlib
 import logging
+import os
+import time
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, Dict, List
 
 import base64
 import asyncio
-import uvicorn
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.routing import Route
 
-from mcp.server.fastmcp import FastMCP
+from mcp.server.auth.middleware.auth_context import get_access_token
+from mcp.server.fastmcp import Context, FastMCP
+from mcp.server.fastmcp.exceptions import ToolError
 
-# Gmail API
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+# Gmail API : importée au premier scan Gmail ou par le pré-chargement
+# lancé après le démarrage (voir _prewarm), pas à l'import du module.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
 # --- modules locaux (même dossier) ---
-from connection import DatabaseManager
+from tenants import SESSION_PREFIX, FileTenantStore, TenantShardMap
+from snapshots import SnapshotTenantStore
+from sqlite_store import SQLiteTenantStore
+from jobs import DONE, FINISHED, ScanCheckpoint, ScanCheckpoints, ScanJob, ScanJobManager
+from gmail_scheduler import GmailScheduler, is_transient, scheduler_for
+from pagination import CursorError, ResultCache
+import metrics
+from metrics import GMAIL_BYTES, instrument_tool, timed_parser
 from analyzer import SubscriptionAnalyzer
 from email_parser import EmailParser
 from csv_parser import BankCSVParser
@@ -38,15 +50,32 @@ log = logging.getLogger("subscription-http")
 # Gmail OAuth helpers
 # --------------------------------------------------------------------
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+GMAIL_MODULES = (
+    "googleapiclient.discovery",
+    "google.oauth2.credentials",
+    "google_auth_oauthlib.flow",
+    "google.auth.transport.requests",
+)
+# Coupe-circuit des scans : arrêt après N messages consécutifs en échec
+# transitoire (reprises épuisées) ou au-delà d'une durée totale (0 = aucun)
+GMAIL_BREAKER_FAILURES = int(os.environ.get("GMAIL_BREAKER_FAILURES", "5"))
+GMAIL_SCAN_BUDGET_SECONDS = float(os.environ.get("GMAIL_SCAN_BUDGET_SECONDS", "900"))
+
+class GmailUnavailable(Exception):
+    """Panne Gmail durable pendant un scan : le reste est gardé pour la reprise."""
 
 def _load_gmail_credentials(
     client_secret_file: str = "client_secret.json",
     token_file: str = "token.json"
-) -> Credentials:
+) -> "Credentials":
     """
     Charge / rafraîchit / crée des credentials OAuth Gmail.
     (bloquant — à appeler via asyncio.to_thread côté async)
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     try:
         creds = Credentials.from_authorized_user_file(token_file, GMAIL_SCOPES)
@@ -64,11 +93,13 @@ def _load_gmail_credentials(
             f.write(creds.to_json())
     return creds
 
-def _gmail_service(
-    client_secret_file: str = "client_secret.json",
-    token_file: str = "token.json"
-):
-    creds = _load_gmail_credentials(client_secret_file, token_file)
+def _gmail_client(creds: "Credentials"):
+    """
+    Client Gmail sur des credentials déjà chargés : les fetchers d'un scan en
+    construisent un chacun sans relire ni réécrire token.json.
+    """
+    from googleapiclient.discovery import build
+
     return build("gmail", "v1", credentials=creds)
 
 def _extract_text_from_payload(payload) -> str:
@@ -105,22 +136,350 @@ def _extract_text_from_payload(payload) -> str:
                 continue
     return ""
 
+def _prewarm() -> None:
+    """
+    Charge ce qui a été différé à l'import (pile Gmail/OAuth) et fait un
+    premier passage dans le parseur d'e-mails (compilation des regex), pour
+    que le premier scan ne paie pas ce coût.
+    (bloquant — lancé via asyncio.to_thread après le démarrage)
+    """
+    start = time.perf_counter()
+    for name in GMAIL_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            log.warning("prewarm: %s unavailable (%s)", name, e)
+    email_parser.parse_email("Your subscription of 0.00€ has been renewed")
+    log.info("prewarm done in %.2fs", time.perf_counter() - start)
+
+async def _prewarm_later(delay: float) -> None:
+    # Après le démarrage : les premières requêtes passent avant le pré-chargement.
+    await asyncio.sleep(delay)
+    await asyncio.to_thread(_prewarm)
+
 # --------------------------------------------------------------------
 # MCP server (HTTP streamable)
 # --------------------------------------------------------------------
-mcp = FastMCP("subscription-manager")
+# Mode sans état (multi-workers) : pas de session MCP à garder collée à un worker.
+mcp = FastMCP(
+    "subscription-manager",
+    stateless_http=os.environ.get("MCP_STATELESS_HTTP", "0") == "1",
+)
 
 # Dépendances partagées
-db = DatabaseManager()
-analyzer = SubscriptionAnalyzer(db)
+def _tenant_store():
+    """
+    "snapshot" (défaut) : un snapshot compressé par tenant (SNAPSHOT_DIR), un
+      seul process ; relit les JSON de TENANT_STATE_DIR non encore migrés.
+    "file" : un JSON par tenant (format historique), un seul process.
+    "sqlite" : fichier partagé entre workers, écriture immédiate + invalidation.
+    """
+    kind = os.environ.get("SUBSCRIPTION_STORE", "snapshot")
+    if kind == "sqlite":
+        return SQLiteTenantStore(os.environ.get("SQLITE_PATH", "subscriptions.db"))
+    legacy = FileTenantStore(os.environ.get("TENANT_STATE_DIR", ".tenants"))
+    if kind == "file":
+        return legacy
+    return SnapshotTenantStore(os.environ.get("SNAPSHOT_DIR", ".snapshots"), legacy=legacy)
+
+# Un store par tenant (session MCP ou sujet OAuth), évincé quand inactif.
+tenant_store = _tenant_store()
+shards = TenantShardMap(
+    tenant_store,
+    idle_seconds=float(os.environ.get("TENANT_IDLE_SECONDS", "900")),
+    max_resident=int(os.environ.get("TENANT_MAX_RESIDENT", "1000")),
+    session_ttl=float(os.environ.get("SESSION_STATE_TTL", "86400")),
+)
+# Scans longs en arrière-plan : file bornée + workers
+scan_jobs = ScanJobManager(
+    workers=int(os.environ.get("SCAN_WORKERS", "2")),
+    max_queued=int(os.environ.get("SCAN_QUEUE_SIZE", "100")),
+    # état des jobs visible depuis tous les workers si le store est partagé
+    state=tenant_store if tenant_store.write_through else None,
+)
+# Résultats paginés : les curseurs relisent le même ensemble figé
+result_pages = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_ENTRIES", "256")),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", "600")),
+    # store partagé : curseurs valides sur tous les workers
+    state=tenant_store if tenant_store.write_through else None,
+)
+# Reprise des scans Gmail interrompus (quota, erreurs transitoires épuisées)
+scan_checkpoints = ScanCheckpoints(ttl_seconds=float(os.environ.get("SCAN_CHECKPOINT_TTL", "3600")))
+analyzer = SubscriptionAnalyzer(None)  # sans état : le store dépend du tenant
 email_parser = EmailParser()
 csv_parser = BankCSVParser()
 
+DEFAULT_TENANT = "default"
+# X-Tenant-Id n'est accepté qu'en mode sans état, accompagné du secret partagé
+# (X-Tenant-Secret) connu du proxy ou de la passerelle de confiance.
+STATELESS_HTTP = os.environ.get("MCP_STATELESS_HTTP", "0") == "1"
+TENANT_HEADER_SECRET = os.environ.get("TENANT_HEADER_SECRET")
+
+def _header_tenant(request) -> Optional[str]:
+    if not STATELESS_HTTP or not TENANT_HEADER_SECRET:
+        return None
+    secret = request.headers.get("x-tenant-secret", "")
+    if not hmac.compare_digest(secret.encode("utf-8"), TENANT_HEADER_SECRET.encode("utf-8")):
+        return None
+    return request.headers.get("x-tenant-id") or None
+
+def _tenant_id(ctx: Optional[Context]) -> str:
+    """
+    Tenant de l'appel : sujet OAuth si authentifié, sinon header X-Tenant-Id
+    (mode sans état avec TENANT_HEADER_SECRET uniquement), sinon header
+    Mcp-Session-Id. En mode sans état, une requête HTTP sans aucun de ces
+    identifiants est refusée : le tenant par défaut serait partagé par tous.
+    """
+    token = get_access_token()
+    if token is not None:
+        # l'utilisateur ; client_id (l'application) seulement sans sujet
+        if token.subject:
+            return f"subject:{token.subject}"
+        if token.client_id:
+            return f"client:{token.client_id}"
+    try:
+        request = ctx.request_context.request if ctx is not None else None
+    except ValueError:
+        request = None
+    if request is None:
+        return DEFAULT_TENANT
+    # Jamais en mode avec état : l'id de session émis par le serveur fait foi.
+    tenant = _header_tenant(request)
+    if tenant:
+        return f"tenant:{tenant}"
+    session_id = request.headers.get("mcp-session-id")
+    if session_id:
+        return f"{SESSION_PREFIX}{session_id}"
+    if STATELESS_HTTP:
+        raise ToolError("No tenant for this request: authenticate or send X-Tenant-Id with X-Tenant-Secret")
+    return DEFAULT_TENANT
+
 # --------------------------------------------------------------------
 # TOOLS
 # --------------------------------------------------------------------
+SCAN_SOURCES = ("email", "csv", "gmail")
+
+ProgressCallback = Callable[[int, Optional[int], int], Awaitable[None]]
+
+async def _record_parsed(tenant: str, parsed: Dict, **extra) -> None:
+    async with shards.use(tenant, write=True) as db:
+        await db.add_subscription({
+            'name': parsed.get('service', 'Unknown'),
+            'cost': parsed.get('amount', 0),
+            'currency': parsed.get('currency', 'EUR'),
+            'billing_cycle': 'monthly',
+            'category': parsed.get('category', 'other'),
+            'status': 'active',
+            'start_date': datetime.now().isoformat(),
+            **extra,
+        })
+
+async def _gmail_list(scheduler: GmailScheduler, service, query: str, max_results: int) -> List[str]:
+    """Ids des messages correspondant à la requête (pages de 500 au plus)."""
+    message_ids: List[str] = []
+    page_token = None
+    while len(message_ids) < max_results:
+        page = await scheduler.execute("list", lambda: service.users().messages().list(
+            userId="me", q=query, maxResults=min(max_results - len(message_ids), 500), pageToken=page_token
+        ).execute()) or {}
+        message_ids.extend(ref["id"] for ref in page.get("messages", []) or [])
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            break
+    return message_ids[:max_results]
+
+async def _scan(
+    source: str,
+    credentials: Optional[Dict],
+    tenant: str,
+    progress: ProgressCallback,
+    errors: List[str],
+) -> List[Dict]:
+    """
+    Corps commun du scan (mode direct ou job). progress(done, total, found) est
+    appelé au fil de l'eau ; les erreurs par message sont ajoutées à errors.
+    """
+    subscriptions: List[Dict] = []
+
+    if source == "email":
+        # ---- MOCK EMAILS (MVP) ----
+        mock_emails = [
+            "Your Netflix subscription of €15.99 has been renewed",
+            "Spotify Premium: €9.99 charged to your account",
+            "Adobe Creative Cloud: Payment received €54.99",
+            "Dropbox Plus: €11.99 monthly subscription",
+            "GitHub Pro: $7 monthly payment confirmed",
+        ]
+        for i, email_content in enumerate(mock_emails, 1):
+            with timed_parser("email"):
+                parsed = email_parser.parse_email(email_content)
+            if parsed:
+                subscriptions.append(parsed)
+                await _record_parsed(tenant, parsed)
+            await progress(i, len(mock_emails), len(subscriptions))
+
+    elif source == "csv":
+        # ---- CSV ----
+        if credentials and 'file_path' in credentials:
+            # lecture bloquante -> thread
+            with timed_parser("csv") as timer:
+                subscriptions = await asyncio.to_thread(
+                    csv_parser.parse_csv,
+                    credentials['file_path'],
+                    credentials.get('bank_format', 'generic'),
+                )
+                timer.items = len(subscriptions)
+        await progress(1, 1, len(subscriptions))
+
+    elif source == "gmail":
+        # ---- GMAIL (réel) ----
+        creds_dict = credentials or {}
+        client_secret_file = creds_dict.get("client_secret_file", "client_secret.json")
+        token_file = creds_dict.get("token_file", "token.json")
+        query = creds_dict.get(
+            "query",
+            "subject:(subscription OR abonnement OR confirmation) newer_than:365d"
+        )
+        max_results = int(creds_dict.get("max_results", 50))
+
+        scheduler = scheduler_for(token_file)
+        # client Gmail en thread (car lib bloquante)
+        creds = await asyncio.to_thread(_load_gmail_credentials, client_secret_file, token_file)
+        service = await asyncio.to_thread(_gmail_client, creds)
+
+        # Reprise d'un scan interrompu avec les mêmes paramètres, sinon nouvelle
+        # liste ; un scan identique lancé pendant la liste attend et la partage.
+        checkpoint_key = f"{token_file}\x00{query}\x00{max_results}"
+        async with scan_checkpoints.lock(tenant, checkpoint_key):
+            checkpoint = scan_checkpoints.get(tenant, checkpoint_key)
+            if checkpoint is None:
+                checkpoint = ScanCheckpoint(await _gmail_list(scheduler, service, query, max_results))
+                scan_checkpoints.put(tenant, checkpoint_key, checkpoint)
+        total = len(checkpoint.message_ids)
+        pending = iter(checkpoint.pending)
+        await progress(len(checkpoint.done), total, len(checkpoint.found))
+
+        failures = 0  # messages consécutifs en échec transitoire, reprises épuisées
+
+        async def fetch(client, message_id: str) -> None:
+            nonlocal failures
+            try:
+                msg = await scheduler.execute("get", lambda: client.users().messages().get(
+                    userId="me", id=message_id, format="full"
+                ).execute())
+            except Exception as e:
+                # un message en échec ne fait pas échouer tout le scan ;
+                # en erreur transitoire il reste à faire pour la reprise
+                log.warning("gmail message %s failed: %s", message_id, e)
+                errors.append(f"{message_id}: {e}")
+                if not is_transient(e):
+                    checkpoint.done.add(message_id)
+                    await progress(len(checkpoint.done), total, len(checkpoint.found))
+                    return
+                failures += 1
+                if GMAIL_BREAKER_FAILURES and failures >= GMAIL_BREAKER_FAILURES:
+                    raise GmailUnavailable(f"{failures} consecutive messages failed")
+                return
+            failures = 0
+            GMAIL_BYTES.inc(amount=msg.get("sizeEstimate", 0) or 0)
+            text = _extract_text_from_payload(msg.get("payload"))
+            if not text:
+                # fallback: snippet
+                text = msg.get("snippet", "")
+            if text:
+                with timed_parser("email"):
+                    parsed = email_parser.parse_email(text)
+                if parsed:
+                    checkpoint.found[message_id] = parsed
+                    await _record_parsed(tenant, parsed, source_message_id=message_id)
+            checkpoint.done.add(message_id)
+            await progress(len(checkpoint.done), total, len(checkpoint.found))
+
+        async def fetcher(client) -> None:
+            if client is None:
+                # googleapiclient n'est pas thread-safe (httplib2) : un client par fetcher
+                client = await asyncio.to_thread(_gmail_client, creds)
+            for message_id in pending:
+                if message_id in checkpoint.done or message_id in checkpoint.fetching:
+                    continue  # traité ou en cours dans un scan identique
+                checkpoint.claim(message_id)
+                try:
+                    await fetch(client, message_id)
+                finally:
+                    checkpoint.release(message_id)
+
+        # récupérer & parser, à la concurrence permise par l'ordonnanceur
+        fetchers = min(scheduler.max_concurrency, total - len(checkpoint.done))
+        tasks = [asyncio.create_task(fetcher(service if i == 0 else None)) for i in range(fetchers)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks), GMAIL_SCAN_BUDGET_SECONDS or None)
+        except GmailUnavailable as e:
+            # panne durable : inutile d'épuiser les reprises sur chaque message
+            errors.append(f"gmail unavailable, scan stopped: {e}")
+        except asyncio.TimeoutError:
+            errors.append(f"gmail scan stopped after {GMAIL_SCAN_BUDGET_SECONDS:g}s")
+        finally:
+            for task in tasks:
+                task.cancel()  # un fetcher en échec arrête les autres
+
+        # messages encore en cours dans un scan identique : résultat complet
+        await checkpoint.settled()
+        remaining = total - len(checkpoint.done)
+        if remaining:
+            errors.append(f"{remaining} message(s) not fetched, run the same scan again to resume")
+        else:
+            scan_checkpoints.drop(tenant, checkpoint_key)
+        subscriptions = checkpoint.results()
+
+    return subscriptions
+
+async def _scan_summary(
+    source: str,
+    subscriptions: List[Dict],
+    tenant: str,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    summary_only: bool = False,
+) -> Dict:
+    total_monthly = round(sum(
+        s.get('amount', 0) for s in subscriptions if s.get('cycle') == 'monthly'
+    ), 2)
+    summary = {"subscriptions_found": len(subscriptions)}
+    if not summary_only:
+        page = await result_pages.first_page(tenant, subscriptions, limit, fields)
+        summary["subscriptions"] = page["items"]
+        if page["next_cursor"]:
+            summary["next_cursor"] = page["next_cursor"]
+    summary["total_monthly"] = total_monthly
+    summary["source"] = source
+    return summary
+
+async def _next_page(key: str, tenant: str, cursor: str, limit: Optional[int], fields: Optional[List[str]]) -> Dict:
+    """Page suivante d'un résultat mis en cache (aucun recalcul)."""
+    try:
+        page = await result_pages.next_page(tenant, cursor, limit, fields)
+    except CursorError as e:
+        return {"success": False, "error": str(e)}
+    return {
+        "success": True,
+        key: page["items"],
+        "next_cursor": page["next_cursor"],
+        "total": page["total"],
+    }
+
 @mcp.tool()
-async def scan_subscriptions(source: str, credentials: Optional[Dict] = None) -> Dict:
+@instrument_tool
+async def scan_subscriptions(
+    source: str,
+    credentials: Optional[Dict] = None,
+    background: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    summary_only: bool = False,
+    ctx: Context = None,
+) -> Dict:
     """
     Scan des abonnements depuis différentes sources.
 
@@ -136,119 +495,122 @@ async def scan_subscriptions(source: str, credentials: Optional[Dict] = None) ->
           "query": "subject:(subscription OR abonnement OR confirmation) newer_than:365d",
           "max_results": 50
         }
+        Un scan gmail interrompu (quota, erreurs transitoires) se reprend en
+        le relançant avec les mêmes query / max_results.
+      background: True -> renvoie tout de suite un job_id à suivre avec
+        get_scan_status (et à annuler avec cancel_scan).
+      limit / cursor: pagination de la liste "subscriptions" ; avec cursor,
+        renvoie la page suivante du scan précédent sans rescanner.
+      fields: champs à garder par abonnement (ex. ["service", "amount"])
+      summary_only: uniquement les totaux, sans la liste
     """
-    try:
-        subscriptions: List[Dict] = []
-
-        if source == "email":
-            # ---- MOCK EMAILS (MVP) ----
-            mock_emails = [
-                "Your Netflix subscription of €15.99 has been renewed",
-                "Spotify Premium: €9.99 charged to your account",
-                "Adobe Creative Cloud: Payment received €54.99",
-                "Dropbox Plus: €11.99 monthly subscription",
-                "GitHub Pro: $7 monthly payment confirmed",
-            ]
-            for email_content in mock_emails:
-                parsed = email_parser.parse_email(email_content)
-                if parsed:
-                    subscriptions.append(parsed)
-                    await db.add_subscription({
-                        'name': parsed.get('service', 'Unknown'),
-                        'cost': parsed.get('amount', 0),
-                        'currency': parsed.get('currency', 'EUR'),
-                        'billing_cycle': 'monthly',
-                        'category': parsed.get('category', 'other'),
-                        'status': 'active',
-                        'start_date': datetime.now().isoformat(),
-                    })
-
-        elif source == "csv":
-            # ---- CSV ----
-            if credentials and 'file_path' in credentials:
-                patterns = csv_parser.parse_csv(
-                    credentials['file_path'],
-                    credentials.get('bank_format', 'generic')
-                )
-                subscriptions = patterns
-
-        elif source == "gmail":
-            # ---- GMAIL (réel) ----
-            creds_dict = credentials or {}
-            client_secret_file = creds_dict.get("client_secret_file", "client_secret.json")
-            token_file = creds_dict.get("token_file", "token.json")
-            query = creds_dict.get(
-                "query",
-                "subject:(subscription OR abonnement OR confirmation) newer_than:365d"
-            )
-            max_results = int(creds_dict.get("max_results", 50))
-
-            # client Gmail en thread (car lib bloquante)
-            service = await asyncio.to_thread(_gmail_service, client_secret_file, token_file)
+    if cursor:
+        return await _next_page("subscriptions", _tenant_id(ctx), cursor, limit, fields)
+    if source not in SCAN_SOURCES:
+        return {
+            "success": False,
+            "error": f"Unknown source '{source}'",
+            "subscriptions_found": 0
+        }
+    tenant = _tenant_id(ctx)
 
-            # lister les messages
-            msg_list = await asyncio.to_thread(
-                lambda: service.users().messages().list(
-                    userId="me", q=query, maxResults=max_results
-                ).execute()
-            )
-            message_refs = (msg_list or {}).get("messages", []) or []
-
-            # récupérer & parser
-            for ref in message_refs:
-                msg = await asyncio.to_thread(
-                    lambda: service.users().messages().get(
-                        userId="me", id=ref["id"], format="full"
-                    ).execute()
-                )
-                text = _extract_text_from_payload(msg.get("payload"))
-                if not text:
-                    # fallback: snippet
-                    text = msg.get("snippet", "")
-                if not text:
-                    continue
+    if background:
+        async def run(job: ScanJob) -> List[Dict]:
+            async def progress(done: int, total: Optional[int], found: int) -> None:
+                job.update(done, total, found)
+            return await _scan(source, credentials, tenant, progress, job.errors)
 
-                parsed = email_parser.parse_email(text)
-                if parsed:
-                    subscriptions.append(parsed)
-                    await db.add_subscription({
-                        'name': parsed.get('service', 'Unknown'),
-                        'cost': parsed.get('amount', 0),
-                        'currency': parsed.get('currency', 'EUR'),
-                        'billing_cycle': 'monthly',
-                        'category': parsed.get('category', 'other'),
-                        'status': 'active',
-                        'start_date': datetime.now().isoformat(),
-                        'source_message_id': ref["id"],
-                    })
+        try:
+            job = scan_jobs.submit(tenant, source, run)
+        except asyncio.QueueFull:
+            return {"success": False, "error": "Too many scans queued, retry later"}
+        return {"success": True, **job.to_dict()}
 
-        else:
-            return {
-                "success": False,
-                "error": f"Unknown source '{source}'",
-                "subscriptions_found": 0
-            }
+    try:
+        errors: List[str] = []
 
-        total_monthly = round(sum(
-            s.get('amount', 0) for s in subscriptions if s.get('cycle') == 'monthly'
-        ), 2)
+        async def progress(done: int, total: Optional[int], found: int) -> None:
+            # notifications MCP si le client a fourni un progressToken
+            if ctx is not None:
+                await ctx.report_progress(done, total, f"{found} subscription(s) found")
 
-        return {
+        subscriptions = await _scan(source, credentials, tenant, progress, errors)
+        result = {
             "success": True,
-            "subscriptions_found": len(subscriptions),
-            "subscriptions": subscriptions,
-            "total_monthly": total_monthly,
-            "source": source,
-            "timestamp": datetime.now().isoformat(),
+            **(await _scan_summary(source, subscriptions, tenant, limit, fields, summary_only)),
         }
+        if errors:
+            result["errors"] = errors
+        result["timestamp"] = datetime.now().isoformat()
+        return result
 
     except Exception as e:
         log.exception("scan_subscriptions failed")
         return {"success": False, "error": str(e), "subscriptions_found": 0}
 
 @mcp.tool()
+@instrument_tool
+async def get_scan_status(
+    job_id: str,
+    wait_seconds: float = 0,
+    include_results: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    ctx: Context = None,
+) -> Dict:
+    """
+    État d'un scan lancé avec background=True.
+
+    Args:
+      wait_seconds: attend (max 60 s) la fin du job en envoyant des notifications
+        de progression MCP à chaque avancée, si le client les supporte.
+      include_results: ajoute les abonnements trouvés une fois le job terminé.
+      limit / cursor / fields: pagination et projection des résultats.
+    """
+    tenant = _tenant_id(ctx)
+    if cursor:
+        return await _next_page("subscriptions", tenant, cursor, limit, fields)
+    job = await scan_jobs.get(job_id, tenant)
+    if job is None:
+        return {"success": False, "error": f"Scan job '{job_id}' not found"}
+
+    deadline = time.monotonic() + min(max(wait_seconds, 0), 60)
+    while job.status not in FINISHED and time.monotonic() < deadline:
+        if await job.wait_changed(deadline - time.monotonic()) and ctx is not None:
+            await ctx.report_progress(job.done, job.total, f"{job.found} subscription(s) found")
+
+    result = {"success": True, **job.to_dict()}
+    if include_results and job.status == DONE:
+        if job.result is None:
+            # RemoteScanJob : la liste n'existe que dans la mémoire de l'autre worker
+            result["success"] = False
+            result["error"] = (
+                f"Results of scan job '{job_id}' are held by another worker; "
+                "the subscriptions found are saved, list them with analyze_spending"
+            )
+        else:
+            result.update(await _scan_summary(job.source, job.result, tenant, limit, fields))
+    return result
+
+@mcp.tool()
+@instrument_tool
+async def cancel_scan(job_id: str, ctx: Context = None) -> Dict:
+    """Annule un scan en file ou en cours ; les abonnements déjà enregistrés restent."""
+    job = await scan_jobs.cancel(job_id, _tenant_id(ctx))
+    if job is None:
+        return {"success": False, "error": f"Scan job '{job_id}' not found"}
+    return {"success": True, **job.to_dict()}
+
+@mcp.tool()
+@instrument_tool
 async def add_subscription(
-    name: str, cost: float, cycle: str, category: str = "other", currency: str = "EUR"
+    name: str,
+    cost: float,
+    cycle: str,
+    category: str = "other",
+    currency: str = "EUR",
+    ctx: Context = None,
 ) -> Dict:
     try:
         subscription_id = str(uuid.uuid4())
@@ -263,7 +625,8 @@ async def add_subscription(
             'start_date': datetime.now().isoformat(),
             'created_at': datetime.now().isoformat(),
         }
-        await db.add_subscription(subscription_data)
+        async with shards.use(_tenant_id(ctx), write=True) as db:
+            await db.add_subscription(subscription_data)
         next_billing = analyzer.calculate_next_billing(cycle)
         return {
             "success": True,
@@ -280,9 +643,44 @@ async def add_subscription(
         return {"success": False, "error": str(e)}
 
 @mcp.tool()
-async def analyze_spending() -> Dict:
+@instrument_tool
+async def analyze_spending(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None,
+    category: Optional[str] = None,
+    currency: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    summary_only: bool = False,
+    ctx: Context = None,
+) -> Dict:
+    """
+    Analyse des dépenses, optionnellement filtrée.
+
+    Args:
+      start_date / end_date: bornes incluses sur start_date, préfixes ISO ("2025-01", "2025-01-31")
+      status: ex. "active" pour exclure les abonnements annulés
+      category: ex. "streaming"
+      currency: ex. "EUR"
+      limit: ajoute une page "subscriptions" des abonnements analysés
+      cursor: page suivante de cette liste, lue sur le même snapshot
+      fields: champs à garder par abonnement (ex. ["name", "cost"])
+      summary_only: uniquement total_monthly / total_yearly / subscription_count
+    """
     try:
-        subscriptions = await db.get_all_subscriptions()
+        tenant = _tenant_id(ctx)
+        if cursor:
+            return await _next_page("subscriptions", tenant, cursor, limit, fields)
+        async with shards.use(tenant) as db:
+            subscriptions = await db.query_subscriptions(
+                start_date=start_date,
+                end_date=end_date,
+                status=status,
+                category=category,
+                currency=currency,
+            )
         if not subscriptions:
             return {
                 "success": True,
@@ -290,6 +688,16 @@ async def analyze_spending() -> Dict:
                 "total_monthly": 0,
                 "total_yearly": 0,
             }
+        if summary_only:
+            total_monthly = analyzer.calculate_monthly_spending(subscriptions)
+            return {
+                "success": True,
+                "total_monthly": total_monthly,
+                "total_yearly": round(total_monthly * 12, 2),
+                "subscription_count": len(subscriptions),
+                "currency": currency or "EUR",
+                "generated_at": datetime.now().isoformat(),
+            }
         analysis = {
             "total_monthly": analyzer.calculate_monthly_spending(subscriptions),
             "total_yearly": 0,
@@ -300,29 +708,44 @@ async def analyze_spending() -> Dict:
             "subscription_count": len(subscriptions),
         }
         categories: Dict[str, Dict[str, float]] = {}
+        # Slots des SubscriptionRecord lus directement (pas de Mapping.get)
         for sub in subscriptions:
-            cat = sub.get('category', 'other')
+            cat = sub.category if sub.category is not None else 'other'
             categories.setdefault(cat, {'count': 0, 'total': 0.0})
             categories[cat]['count'] += 1
             categories[cat]['total'] += analyzer.normalize_to_monthly(
-                sub.get('cost', 0), sub.get('billing_cycle', 'monthly')
+                sub.cost or 0, sub.billing_cycle or 'monthly'
             )
         analysis['by_category'] = categories
         analysis['total_yearly'] = round(analysis['total_monthly'] * 12, 2)
 
-        me = max(subscriptions, key=lambda x: x.get('cost', 0), default=None)
+        me = max(subscriptions, key=lambda x: x.cost or 0, default=None)
         if me:
             analysis['most_expensive'] = {
-                'name': me.get('name'),
-                'cost': me.get('cost'),
-                'cycle': me.get('billing_cycle'),
+                'name': me.name,
+                'cost': me.cost,
+                'cycle': me.billing_cycle,
             }
 
         analysis['least_used'] = analyzer.find_unused_subscriptions(subscriptions)
+        analysis['monthly_series'] = analyzer.monthly_series(subscriptions, start_date, end_date)
+        if limit is not None:
+            page = await result_pages.first_page(tenant, subscriptions, limit, fields)
+            analysis['subscriptions'] = page["items"]
+            analysis['next_cursor'] = page["next_cursor"]
         return {
             "success": True,
             "analysis": analysis,
-            "currency": "EUR",
+            "filters": {
+                k: v for k, v in {
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "status": status,
+                    "category": category,
+                    "currency": currency,
+                }.items() if v is not None
+            },
+            "currency": currency or "EUR",
             "generated_at": datetime.now().isoformat(),
         }
     except Exception as e:
@@ -330,9 +753,29 @@ async def analyze_spending() -> Dict:
         return {"success": False, "error": str(e)}
 
 @mcp.tool()
-async def get_recommendations() -> Dict:
+@instrument_tool
+async def get_recommendations(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    summary_only: bool = False,
+    ctx: Context = None,
+) -> Dict:
+    """
+    Recommandations d'économies.
+
+    Args:
+      limit: taille de page (5 par défaut)
+      cursor: page suivante, sans recalcul
+      fields: champs à garder par recommandation (ex. ["type", "savings"])
+      summary_only: uniquement les économies potentielles et le nombre de recommandations
+    """
     try:
-        subscriptions = await db.get_all_subscriptions()
+        tenant = _tenant_id(ctx)
+        if cursor:
+            return await _next_page("recommendations", tenant, cursor, limit, fields)
+        async with shards.use(tenant) as db:
+            subscriptions = await db.get_all_subscriptions()
         if not subscriptions:
             return {"success": True, "recommendations": [], "potential_savings": 0}
         recommendations: List[Dict] = []
@@ -363,52 +806,66 @@ async def get_recommendations() -> Dict:
             "Dropbox Plus": {"alternative": "Google One", "savings": 10.00},
         }
         for sub in subscriptions:
-            if sub.get('name') in alternatives:
-                alt = alternatives[sub['name']]
+            if sub.name in alternatives:
+                alt = alternatives[sub.name]
                 recommendations.append({
                     "type": "alternative",
                     "severity": "low",
-                    "service": sub['name'],
+                    "service": sub.name,
                     "action": f"Switch to {alt['alternative']}",
                     "savings": alt['savings'],
                 })
                 total_savings += alt['savings']
 
-        streaming = [s for s in subscriptions if s.get('category') == 'streaming']
+        streaming = [s for s in subscriptions if s.category == 'streaming']
         if len(streaming) > 2:
             est = len(streaming) * 5
             recommendations.append({
                 "type": "bundle",
                 "severity": "medium",
-                "services": [s['name'] for s in streaming],
+                "services": [s.name for s in streaming],
                 "action": "Consider a streaming bundle package",
                 "savings": est,
             })
             total_savings += est
 
-        return {
-            "success": True,
-            "recommendations": recommendations[:5],
+        result = {"success": True}
+        if not summary_only:
+            page = await result_pages.first_page(tenant, recommendations, limit or 5, fields)
+            result["recommendations"] = page["items"]
+            if page["next_cursor"]:
+                result["next_cursor"] = page["next_cursor"]
+        result.update({
             "potential_monthly_savings": round(total_savings, 2),
             "potential_yearly_savings": round(total_savings * 12, 2),
             "total_recommendations": len(recommendations),
-        }
+        })
+        return result
     except Exception as e:
         log.exception("get_recommendations failed")
         return {"success": False, "error": str(e)}
 
 @mcp.tool()
-async def cancel_subscription(subscription_id: str, generate_email: bool = True) -> Dict:
+@instrument_tool
+async def cancel_subscription(
+    subscription_id: str, generate_email: bool = True, ctx: Context = None
+) -> Dict:
     try:
-        subscription = await db.get_subscription(subscription_id)
-        if not subscription:
-            all_subs = await db.get_all_subscriptions()
-            subscription = next(
-                (s for s in all_subs if s.get('name', '').lower() == subscription_id.lower()),
-                None
+        async with shards.use(_tenant_id(ctx), write=True) as db:
+            subscription = await db.get_subscription(subscription_id)
+            if not subscription:
+                all_subs = await db.get_all_subscriptions()
+                subscription = next(
+                    (s for s in all_subs if s.get('name', '').lower() == subscription_id.lower()),
+                    None
+                )
+            if not subscription:
+                return {"success": False, "error": f"Subscription '{subscription_id}' not found"}
+
+            await db.update_subscription(
+                subscription.get('id', subscription_id),
+                {'status': 'cancelled', 'cancelled_at': datetime.now().isoformat()}
             )
-        if not subscription:
-            return {"success": False, "error": f"Subscription '{subscription_id}' not found"}
 
         result = {
             "success": True,
@@ -431,10 +888,6 @@ async def cancel_subscription(subscription_id: str, generate_email: bool = True)
             )
             result['email_template'] = email_template
 
-        await db.update_subscription(
-            subscription.get('id', subscription_id),
-            {'status': 'cancelled', 'cancelled_at': datetime.now().isoformat()}
-        )
         alternatives = analyzer.find_alternatives(subscription['name'])
         if alternatives:
             result['alternatives'] = alternatives
@@ -450,25 +903,138 @@ async def cancel_subscription(subscription_id: str, generate_email: bool = True)
         log.exception("cancel_subscription failed")
         return {"success": False, "error": str(e)}
 
+@mcp.tool()
+@instrument_tool
+async def export_snapshot(ctx: Context = None) -> Dict:
+    """
+    Sauvegarde immédiate des abonnements du tenant appelant (sans attendre la
+    sauvegarde périodique ni l'éviction). Avec le store SQLite, les données
+    sont déjà écrites à chaque modification.
+    """
+    try:
+        saved = await shards.save_tenant(_tenant_id(ctx))
+        return {"success": True, "store": type(tenant_store).__name__, **saved}
+    except Exception as e:
+        log.exception("export_snapshot failed")
+        return {"success": False, "error": str(e)}
+
 # --------------------------------------------------------------------
 # ROOT ASGI APP (FastMCP expose /mcp et gère lifespan)
 # --------------------------------------------------------------------
-app = mcp.streamable_http_app()
-
 # /health direct sur l’app MCP
 async def health(_):
     return JSONResponse({"ok": True, "service": "subscription-manager"})
 
-app.router.routes.insert(0, Route("/health", endpoint=health))
+# /metrics au format texte Prometheus (compteurs du worker qui répond)
+async def metrics_endpoint(_):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-# CORS pour tests locaux
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["Mcp-Session-Id"],
-)
+# POST /admin/snapshot : sauvegarde de tous les tenants modifiés (ADMIN_TOKEN requis)
+async def admin_snapshot(request):
+    token = os.environ.get("ADMIN_TOKEN")
+    supplied = request.headers.get("authorization", "").encode("utf-8")
+    if not token or not hmac.compare_digest(supplied, f"Bearer {token}".encode("utf-8")):
+        return JSONResponse({"success": False, "error": "Unauthorized"}, status_code=401)
+    start = time.perf_counter()
+    saved = await shards.flush_dirty()
+    return JSONResponse({
+        "success": True,
+        "tenants_saved": saved,
+        "resident_tenants": len(shards),
+        "seconds": round(time.perf_counter() - start, 3),
+    })
+
+def create_app():
+    """
+    Fabrique de l'app ASGI : appelée une fois par worker uvicorn (factory=True).
+    """
+    app = mcp.streamable_http_app()
+
+    mcp_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(a):
+        # Éviction des tenants inactifs et sauvegardes périodiques ; arrêt des scans et flush sur disque à l'arrêt.
+        async with mcp_lifespan(a):
+            evictor = asyncio.create_task(shards.run_evictor())
+            lag_monitor = asyncio.create_task(
+                metrics.monitor_event_loop(float(os.environ.get("LOOP_LAG_INTERVAL", "0.1")))
+            )
+            snapshotter = None
+            snapshot_interval = float(os.environ.get("SNAPSHOT_INTERVAL", "300"))
+            if snapshot_interval > 0:
+                snapshotter = asyncio.create_task(shards.run_snapshotter(snapshot_interval))
+            prewarm = None
+            if os.environ.get("PREWARM", "1") == "1":
+                prewarm = asyncio.create_task(_prewarm_later(float(os.environ.get("PREWARM_DELAY", "1.0"))))
+            try:
+                yield
+            finally:
+                evictor.cancel()
+                lag_monitor.cancel()
+                if prewarm is not None:
+                    prewarm.cancel()
+                if snapshotter is not None:
+                    shards.stop_snapshotter()
+                    await snapshotter
+                await scan_jobs.stop()
+                await shards.flush_all()
+
+    app.router.lifespan_context = lifespan
+
+    app.router.routes.insert(0, Route("/health", endpoint=health))
+    app.router.routes.insert(0, Route("/metrics", endpoint=metrics_endpoint))
+    app.router.routes.insert(0, Route("/admin/snapshot", endpoint=admin_snapshot, methods=["POST"]))
+
+    # CORS pour tests locaux
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Mcp-Session-Id"],
+    )
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `run_http:app` reste utilisable, sans construire l'app dans chaque worker
+    # lancé en mode factory.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(name)
+
+def main():
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="subscription-manager MCP server")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        help="process uvicorn ; >1 impose le store sqlite, le mode MCP sans état et TENANT_HEADER_SECRET",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1 and not os.environ.get("TENANT_HEADER_SECRET"):
+        # Sans session MCP, rien d'autre ne distingue les utilisateurs.
+        parser.error("--workers > 1 requires TENANT_HEADER_SECRET (tenants come from X-Tenant-Id)")
+    if args.workers > 1:
+        # Hérités par les workers : état partagé via SQLite, pas de session collante.
+        os.environ["SUBSCRIPTION_STORE"] = "sqlite"
+        os.environ["MCP_STATELESS_HTTP"] = "1"
+        uvicorn.run(
+            "run_http:create_app", factory=True,
+            host=args.host, port=args.port, workers=args.workers,
+        )
+    else:
+        uvicorn.run(create_app(), host=args.host, port=args.port)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    main()
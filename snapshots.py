@@ -0,0 +1,182 @@
+# snapshots.py
+"""
+Snapshots du store d'abonnements : JSONL compressé (gzip), lu et écrit en
+streaming.
+
+    ligne 1    : en-tête {"format", "schema", "fields", "count", "created_at", ...}
+    lignes 2.. : un lot = tableau JSON de lignes (valeurs des slots de
+                 SubscriptionRecord, dans l'ordre de "fields")
+    dernière   : {"end": true, "count": n}, absente si le fichier est tronqué
+
+Les valeurs sont déjà encodées (horodatages en µs, ids UUID en entier) : la
+restauration ne reparse aucune date et reconstruit les index une seule fois.
+
+    python -m snapshots info .snapshots/<fichier>.snap.gz
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from records import SubscriptionRecord
+
+SNAPSHOT_FORMAT = "subscription-snapshot"
+SCHEMA_VERSION = 1
+FIELDS = SubscriptionRecord.__slots__
+BATCH_SIZE = 10_000
+
+class SnapshotError(ValueError):
+    pass
+
+def write_snapshot(
+    path: str,
+    records: Sequence[SubscriptionRecord],
+    meta: Optional[Dict[str, Any]] = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Écrit le snapshot (fichier temporaire puis renommage atomique) et renvoie
+    sa taille en octets. records doit être immuable pendant l'écriture : un
+    snapshot de DatabaseManager (tuple d'enregistrements figés) convient.
+    (bloquant — à appeler via asyncio.to_thread côté async)
+    """
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "schema": SCHEMA_VERSION,
+        "fields": list(FIELDS),
+        "count": len(records),
+        "created_at": datetime.now().isoformat(),
+        **(meta or {}),
+    }
+    tmp = f"{path}.tmp"
+    # compresslevel=1 : ~3x plus petit que le JSON brut, pour un coût CPU faible
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=1) as f:
+        f.write(encode(header) + "\n")
+        for i in range(0, len(records), batch_size):
+            f.write(encode([r.to_row() for r in records[i:i + batch_size]]) + "\n")
+        f.write(encode({"end": True, "count": len(records)}) + "\n")
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+class SnapshotReader:
+    """
+    Lecture en streaming : header est disponible dès l'ouverture, batches()
+    produit les enregistrements lot par lot et vérifie la fin du fichier.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = gzip.open(path, "rt", encoding="utf-8")
+        try:
+            self.header = json.loads(self._file.readline() or "null")
+            self._check_header()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _check_header(self) -> None:
+        if not isinstance(self.header, dict) or self.header.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError(f"{self.path}: not a subscription snapshot")
+        schema = self.header.get("schema")
+        if not isinstance(schema, int) or schema > SCHEMA_VERSION:
+            raise SnapshotError(f"{self.path}: unsupported snapshot schema {schema!r}")
+        fields = self.header.get("fields", [])
+        # Champs ajoutés depuis : None ; champs inconnus : ignorés.
+        self._mapping = None if tuple(fields) == FIELDS else [
+            fields.index(f) if f in fields else None for f in FIELDS
+        ]
+
+    def __enter__(self) -> "SnapshotReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._file.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def batches(self) -> Iterator[List[SubscriptionRecord]]:
+        from_row = SubscriptionRecord.from_row
+        mapping = self._mapping
+        count = 0
+        try:
+            for line in self._file:
+                if line.startswith("{"):
+                    footer = json.loads(line)
+                    if footer.get("count") != count:
+                        raise SnapshotError(f"{self.path}: expected {footer.get('count')} records, read {count}")
+                    return
+                rows = json.loads(line)
+                if mapping is not None:
+                    rows = [[None if i is None else row[i] for i in mapping] for row in rows]
+                count += len(rows)
+                yield [from_row(row) for row in rows]
+        except (OSError, EOFError, ValueError) as e:
+            if isinstance(e, SnapshotError):
+                raise
+            raise SnapshotError(f"{self.path}: corrupted snapshot ({e})") from e
+        finally:
+            self._file.close()
+        raise SnapshotError(f"{self.path}: truncated snapshot ({count} records read)")
+
+def read_snapshot(path: str) -> Iterator[SubscriptionRecord]:
+    """Tous les enregistrements du snapshot, en streaming."""
+    return itertools.chain.from_iterable(SnapshotReader(path).batches())
+
+class SnapshotTenantStore:
+    """
+    Store de tenants au format snapshot (un fichier .snap.gz par tenant),
+    write-back comme FileTenantStore : écrit à l'éviction, à l'arrêt et par
+    les sauvegardes périodiques. Un tenant sans snapshot est relu depuis le
+    store JSON historique (legacy), s'il est fourni, puis migré à la
+    prochaine sauvegarde.
+    (bloquant — à appeler via asyncio.to_thread côté async)
+    """
+    write_through = False
+
+    def __init__(self, directory: str = ".snapshots", legacy=None):
+        self.directory = directory
+        self.legacy = legacy
+
+    def _path(self, tenant: str) -> str:
+        digest = hashlib.sha256(tenant.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.snap.gz")
+
+    def load(self, tenant: str):
+        path = self._path(tenant)
+        if not os.path.exists(path):
+            return self.legacy.load(tenant) if self.legacy is not None else None
+        return read_snapshot(path)
+
+    def save(self, tenant: str, subs: Sequence[SubscriptionRecord]) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        return write_snapshot(self._path(tenant), subs, {"tenant": tenant})
+
+    def delete(self, tenant: str) -> None:
+        try:
+            os.remove(self._path(tenant))
+        except FileNotFoundError:
+            pass
+        if self.legacy is not None:
+            self.legacy.delete(tenant)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Inspecte un snapshot d'abonnements.")
+    ap.add_argument("command", choices=["info"])
+    ap.add_argument("path")
+    args = ap.parse_args(argv)
+
+    with SnapshotReader(args.path) as reader:
+        print(json.dumps(reader.header, indent=2, ensure_ascii=False))
+        count = sum(len(batch) for batch in reader.batches())
+    print(f"{count} records, {os.path.getsize(args.path)} bytes, complete")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
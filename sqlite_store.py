@@ -0,0 +1,229 @@
+# sqlite_store.py
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    tenant TEXT NOT NULL,
+    id     TEXT NOT NULL,
+    data   TEXT NOT NULL,
+    PRIMARY KEY (tenant, id)
+);
+CREATE TABLE IF NOT EXISTS tenant_versions (
+    tenant  TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tenant_versions_by_version ON tenant_versions(version);
+CREATE TABLE IF NOT EXISTS scan_jobs (
+    id               TEXT PRIMARY KEY,
+    tenant           TEXT NOT NULL,
+    data             TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    updated          REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_pages (
+    id      TEXT PRIMARY KEY,
+    tenant  TEXT NOT NULL,
+    total   INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_items (
+    result_id TEXT NOT NULL,
+    pos       INTEGER NOT NULL,
+    data      TEXT NOT NULL,
+    PRIMARY KEY (result_id, pos)
+) WITHOUT ROWID;
+"""
+
+class SQLiteTenantStore:
+    """
+    Store partagé entre workers (un fichier SQLite en WAL).
+
+    Chaque écriture d'un tenant prend une nouvelle version tirée d'une séquence
+    globale : les autres workers détectent les changements avec changes_since()
+    et rechargent les shards concernés (write-through, pas de write-back).
+
+    Une connexion par thread : les écritures passent par asyncio.to_thread, les
+    lectures de version (requêtes ponctuelles) se font sur le thread de la boucle.
+    """
+    write_through = True
+
+    def __init__(self, path: str = "subscriptions.db"):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.data_version = None
+        return conn
+
+    # ----------------------------------------------------------------
+    # Abonnements
+    # ----------------------------------------------------------------
+    def load(self, tenant: str) -> Optional[List[Dict]]:
+        rows = self._conn().execute(
+            "SELECT data FROM subscriptions WHERE tenant = ? ORDER BY rowid", (tenant,)
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows] or None
+
+    def save(self, tenant: str, subs: List[Dict]) -> int:
+        """Remplace tout le contenu du tenant ; renvoie la nouvelle version."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM subscriptions WHERE tenant = ?", (tenant,))
+            self._insert(conn, tenant, subs)
+            version, _ = self._bump(conn, tenant)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def delete(self, tenant: str) -> None:
+        """Vide le tenant ; la nouvelle version fait recharger les autres workers."""
+        self.save(tenant, [])
+
+    def upsert(self, tenant: str, subs: Iterable[Dict], expected_version: int) -> Tuple[int, bool]:
+        """
+        Écrit les abonnements modifiés. Renvoie (nouvelle version, conflit) :
+        conflit = un autre worker a écrit ce tenant depuis expected_version.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert(conn, tenant, subs)
+            version, previous = self._bump(conn, tenant)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version, previous != expected_version
+
+    def _insert(self, conn: sqlite3.Connection, tenant: str, subs: Iterable[Dict]) -> None:
+        # ON CONFLICT ... DO UPDATE garde le rowid : l'ordre d'insertion est conservé.
+        conn.executemany(
+            "INSERT INTO subscriptions (tenant, id, data) VALUES (?, ?, ?) "
+            "ON CONFLICT (tenant, id) DO UPDATE SET data = excluded.data",
+            ((tenant, sub['id'], json.dumps(sub)) for sub in subs),
+        )
+
+    def _bump(self, conn: sqlite3.Connection, tenant: str) -> Tuple[int, int]:
+        (version,) = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM tenant_versions").fetchone()
+        row = conn.execute("SELECT version FROM tenant_versions WHERE tenant = ?", (tenant,)).fetchone()
+        conn.execute(
+            "INSERT INTO tenant_versions (tenant, version) VALUES (?, ?) "
+            "ON CONFLICT (tenant) DO UPDATE SET version = excluded.version",
+            (tenant, version),
+        )
+        return version, row[0] if row else 0
+
+    # ----------------------------------------------------------------
+    # Notification de changements
+    # ----------------------------------------------------------------
+    def version(self, tenant: str) -> int:
+        row = self._conn().execute(
+            "SELECT version FROM tenant_versions WHERE tenant = ?", (tenant,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def changed(self) -> bool:
+        """
+        Vrai si une autre connexion a commité depuis le dernier appel sur ce thread
+        (PRAGMA data_version : aucune lecture de table, coût quasi nul).
+        """
+        self._conn()
+        (current,) = self._local.conn.execute("PRAGMA data_version").fetchone()
+        previous, self._local.data_version = self._local.data_version, current
+        return previous != current
+
+    def changes_since(self, seq: int) -> List[Tuple[str, int]]:
+        """(tenant, version) écrits après la séquence seq."""
+        return self._conn().execute(
+            "SELECT tenant, version FROM tenant_versions WHERE version > ? ORDER BY version", (seq,)
+        ).fetchall()
+
+    # ----------------------------------------------------------------
+    # État des scans (visible depuis tous les workers)
+    # ----------------------------------------------------------------
+    def save_job(self, tenant: str, job: Dict[str, Any]) -> bool:
+        """Enregistre l'état du job ; renvoie True si une annulation a été demandée."""
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO scan_jobs (id, tenant, data, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (job["job_id"], tenant, json.dumps(job), time.time()),
+        )
+        row = conn.execute("SELECT cancel_requested FROM scan_jobs WHERE id = ?", (job["job_id"],)).fetchone()
+        return bool(row and row[0])
+
+    def load_job(self, tenant: str, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM scan_jobs WHERE id = ? AND tenant = ?", (job_id, tenant)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def request_cancel(self, tenant: str, job_id: str) -> bool:
+        cur = self._conn().execute(
+            "UPDATE scan_jobs SET cancel_requested = 1 WHERE id = ? AND tenant = ?", (job_id, tenant)
+        )
+        return cur.rowcount > 0
+
+    def prune_jobs(self, older_than_seconds: float) -> None:
+        self._conn().execute(
+            "DELETE FROM scan_jobs WHERE updated < ?", (time.time() - older_than_seconds,)
+        )
+
+    # ----------------------------------------------------------------
+    # Résultats paginés (curseurs valides depuis tous les workers)
+    # ----------------------------------------------------------------
+    def save_result(
+        self, tenant: str, result_id: str, items: List[Dict], start: int, total: int, ttl_seconds: float
+    ) -> None:
+        """items = résultat à partir de la position start ; purge les résultats expirés."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = "SELECT id FROM result_pages WHERE created < ?"
+            conn.execute(f"DELETE FROM result_items WHERE result_id IN ({expired})", (now - ttl_seconds,))
+            conn.execute(f"DELETE FROM result_pages WHERE id IN ({expired})", (now - ttl_seconds,))
+            conn.execute(
+                "INSERT INTO result_pages (id, tenant, total, created) VALUES (?, ?, ?, ?)",
+                (result_id, tenant, total, now),
+            )
+            conn.executemany(
+                "INSERT INTO result_items (result_id, pos, data) VALUES (?, ?, ?)",
+                ((result_id, pos, json.dumps(item, default=str)) for pos, item in enumerate(items, start)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_result(
+        self, tenant: str, result_id: str, offset: int, end: int, ttl_seconds: float
+    ) -> Optional[Tuple[List[Dict], int]]:
+        """(items[offset:end], total), ou None si le résultat a expiré ou n'est pas au tenant."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT total FROM result_pages WHERE id = ? AND tenant = ? AND created >= ?",
+            (result_id, tenant, time.time() - ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT data FROM result_items WHERE result_id = ? AND pos >= ? AND pos < ? ORDER BY pos",
+            (result_id, offset, end),
+        ).fetchall()
+        return [json.loads(data) for (data,) in rows], row[0]
@@ -0,0 +1,339 @@
+# tenants.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Sequence, Union
+
+from connection import DatabaseManager
+from metrics import cache_hit
+from records import SubscriptionRecord
+
+if TYPE_CHECKING:
+    from snapshots import SnapshotTenantStore
+    from sqlite_store import SQLiteTenantStore
+
+log = logging.getLogger("subscription-http.tenants")
+
+# Tenants liés à une session MCP : l'id n'est jamais réutilisé après la fin de
+# la session ni après un redémarrage, leurs données ne sont pas gardées.
+SESSION_PREFIX = "session:"
+
+class FileTenantStore:
+    """
+    Couche persistante minimale : un fichier JSON par tenant, écrit à l'éviction.
+    (bloquant — à appeler via asyncio.to_thread côté async)
+    """
+    write_through = False
+
+    def __init__(self, directory: str = ".tenants"):
+        self.directory = directory
+
+    def _path(self, tenant: str) -> str:
+        # Le tenant vient d'un header : on hache pour obtenir un nom de fichier sûr.
+        digest = hashlib.sha256(tenant.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def load(self, tenant: str) -> Optional[List[Dict]]:
+        try:
+            with open(self._path(tenant), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, tenant: str, subs: Sequence[SubscriptionRecord]) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(tenant)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([r.to_dict() for r in subs], f)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def delete(self, tenant: str) -> None:
+        try:
+            os.remove(self._path(tenant))
+        except FileNotFoundError:
+            pass
+
+class TenantShard:
+    """Store d'un tenant + verrou d'écriture + compteurs d'usage pour l'éviction."""
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self.db = DatabaseManager()
+        self.lock = asyncio.Lock()
+        self.loaded = asyncio.Event()
+        self.active = 0
+        self.dirty = False
+        self.last_used = time.monotonic()
+        # Store partagé : version chargée / écrite, et invalidation par un autre worker
+        self.version = 0
+        self.stale = False
+
+class TenantShardMap:
+    """
+    tenant -> TenantShard, chargé paresseusement depuis le store persistant.
+    Les tenants inactifs (ou les moins récents au-delà de max_resident) sont
+    écrits dans le store puis retirés de la mémoire.
+
+    Avec un store write_through (SQLiteTenantStore, partagé entre workers),
+    chaque écriture est propagée immédiatement et les shards modifiés par un
+    autre worker sont rechargés à l'accès suivant.
+
+    Les tenants de session ne sont écrits qu'à l'éviction (la session peut
+    revenir) : supprimés du store session_ttl secondes après, et tous à l'arrêt.
+    """
+    def __init__(
+        self,
+        store: Union[FileTenantStore, "SnapshotTenantStore", "SQLiteTenantStore"],
+        idle_seconds: float = 900.0,
+        max_resident: int = 1000,
+        session_ttl: float = 86400.0,
+    ):
+        self.store = store
+        self.idle_seconds = idle_seconds
+        self.max_resident = max_resident
+        self.session_ttl = session_ttl
+        self._evicted_sessions: Dict[str, float] = {}  # tenant -> instant d'éviction
+        self._shards: "OrderedDict[str, TenantShard]" = OrderedDict()
+        self._seq = 0  # dernière version globale vue (store partagé)
+        self._stop_snapshots = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    def _invalidate_changed(self) -> None:
+        """
+        Marque périmés les shards écrits par un autre worker. PRAGMA data_version
+        court-circuite le cas courant (rien n'a changé) sans lire de table.
+        """
+        if not self.store.changed():
+            return
+        for tenant, version in self.store.changes_since(self._seq):
+            shard = self._shards.get(tenant)
+            if shard is not None and version > shard.version:
+                shard.stale = True
+            self._seq = max(self._seq, version)
+
+    def _load(self, tenant: str) -> "tuple[DatabaseManager, int]":
+        """
+        Construit le store du tenant hors de la boucle (lecture, décodage et
+        index en bloc) ; il n'est partagé qu'une fois chargé.
+        """
+        # Version lue avant les lignes : une écriture concurrente sera revue comme un changement.
+        version = self.store.version(tenant) if self.store.write_through else 0
+        db = DatabaseManager()
+        rows = self.store.load(tenant)
+        if rows is not None:
+            db.bulk_load(rows)
+        return db, version
+
+    async def _get(self, tenant: str) -> TenantShard:
+        if self.store.write_through:
+            self._invalidate_changed()
+        shard = self._shards.get(tenant)
+        if shard is not None and shard.stale and shard.loaded.is_set():
+            # Les utilisateurs en cours gardent l'ancien store ; les suivants rechargent.
+            del self._shards[tenant]
+            shard = None
+        cache_hit("tenant_shard", shard is not None)
+        if shard is None:
+            # Pas d'await entre le get et l'insertion : un seul chargement par tenant.
+            shard = self._shards[tenant] = TenantShard(tenant)
+            self._evicted_sessions.pop(tenant, None)
+            try:
+                shard.db, shard.version = await asyncio.to_thread(self._load, tenant)
+                shard.db.track_changes = self.store.write_through
+            except BaseException:
+                self._shards.pop(tenant, None)
+                shard.loaded.set()
+                raise
+            shard.loaded.set()
+        else:
+            await shard.loaded.wait()
+            if self._shards.get(tenant) is not shard:
+                # Échec de chargement pendant l'attente : on retente.
+                return await self._get(tenant)
+        self._shards.move_to_end(tenant)
+        return shard
+
+    @asynccontextmanager
+    async def use(self, tenant: str, write: bool = False) -> AsyncIterator[DatabaseManager]:
+        """
+        Donne le store du tenant ; le shard n'est pas évincé tant qu'il est utilisé.
+        write=True sérialise l'appel avec les autres écritures du même tenant.
+        """
+        shard = await self._get(tenant)
+        shard.active += 1
+        try:
+            if write:
+                async with shard.lock:
+                    shard.dirty = True
+                    try:
+                        yield shard.db
+                    finally:
+                        if self.store.write_through:
+                            await self._write_through(shard)
+            else:
+                yield shard.db
+        finally:
+            shard.active -= 1
+            shard.last_used = time.monotonic()
+        if len(self._shards) > self.max_resident:
+            await self._evict_overflow()
+
+    async def _write_through(self, shard: TenantShard) -> None:
+        changes = [r.to_dict() for r in shard.db.drain_changes()]
+        if not changes:
+            return
+        try:
+            version, conflict = await asyncio.to_thread(
+                self.store.upsert, shard.tenant, changes, shard.version
+            )
+        except BaseException:
+            # Mémoire et store divergent : rechargement au prochain accès.
+            shard.stale = True
+            raise
+        shard.version = version
+        if conflict:
+            # Un autre worker a écrit ce tenant entre-temps : on relira tout.
+            shard.stale = True
+
+    async def _evict(self, shard: TenantShard) -> bool:
+        if shard.active:
+            return False
+        async with shard.lock:
+            if shard.active or self._shards.get(shard.tenant) is not shard:
+                return False
+            if shard.dirty and not self.store.write_through:
+                await self._save(shard)
+            # Réutilisé pendant la sauvegarde : on le garde.
+            if shard.active:
+                shard.dirty = False
+                return False
+            del self._shards[shard.tenant]
+            if shard.tenant.startswith(SESSION_PREFIX):
+                self._evicted_sessions[shard.tenant] = time.monotonic()
+            return True
+
+    async def _evict_overflow(self) -> None:
+        # Du moins récemment utilisé au plus récent
+        for shard in list(self._shards.values()):
+            if len(self._shards) <= self.max_resident:
+                break
+            await self._evict(shard)
+
+    async def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.idle_seconds
+        evicted = 0
+        for shard in list(self._shards.values()):
+            if shard.last_used < cutoff and await self._evict(shard):
+                evicted += 1
+        return evicted
+
+    async def run_evictor(self, interval: float = 60.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.evict_idle()
+                if evicted:
+                    log.info("evicted %d idle tenant(s), %d resident", evicted, len(self._shards))
+                purged = await self.purge_sessions()
+                if purged:
+                    log.info("deleted the state of %d expired session(s)", purged)
+            except Exception:
+                log.exception("tenant eviction failed")
+
+    async def _save(self, shard: TenantShard) -> int:
+        """
+        Écrit le snapshot courant du shard (appelant : shard.lock tenu, donc
+        aucune écriture en cours). La sérialisation se fait dans un thread sur
+        le tuple immuable du snapshot.
+        """
+        records = shard.db.snapshot().records
+        size = await asyncio.to_thread(self.store.save, shard.tenant, records)
+        shard.dirty = False
+        return size or 0
+
+    async def save_tenant(self, tenant: str) -> Dict[str, Any]:
+        """Sauvegarde immédiate d'un tenant (outil export_snapshot)."""
+        shard = await self._get(tenant)
+        async with shard.lock:
+            start = time.perf_counter()
+            records = len(shard.db.snapshot().records)
+            if self.store.write_through:
+                # Déjà écrit à chaque modification
+                return {"records": records, "bytes": None, "seconds": 0.0, "written": False}
+            size = await self._save(shard)
+            return {
+                "records": records,
+                "bytes": size,
+                "seconds": round(time.perf_counter() - start, 3),
+                "written": True,
+            }
+
+    async def flush_dirty(self) -> int:
+        """Sauvegarde les tenants modifiés sans les évincer ; renvoie leur nombre."""
+        if self.store.write_through:
+            return 0
+        saved = 0
+        for shard in list(self._shards.values()):
+            if shard.dirty and not shard.tenant.startswith(SESSION_PREFIX):
+                async with shard.lock:
+                    if shard.dirty:
+                        await self._save(shard)
+                        saved += 1
+        return saved
+
+    async def run_snapshotter(self, interval: float) -> None:
+        """
+        Sauvegardes périodiques : une perte au crash limitée à interval secondes.
+        S'arrête avec stop_snapshotter() (pas cancel(), qui interromprait une
+        sauvegarde en cours d'écriture dans son thread).
+        """
+        stop = self._stop_snapshots
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                start = time.perf_counter()
+                saved = await self.flush_dirty()
+                if saved:
+                    log.info("snapshot of %d tenant(s) in %.2fs", saved, time.perf_counter() - start)
+            except Exception:
+                log.exception("periodic snapshot failed")
+
+    def stop_snapshotter(self) -> None:
+        self._stop_snapshots.set()
+
+    async def purge_sessions(self, everything: bool = False) -> int:
+        """
+        Supprime du store les tenants de session évincés depuis plus de
+        session_ttl ; avec everything (arrêt), tous, résidents compris.
+        """
+        cutoff = time.monotonic() - self.session_ttl
+        tenants = [
+            t for t, evicted in self._evicted_sessions.items()
+            if everything or (evicted < cutoff and t not in self._shards)
+        ]
+        if everything:
+            tenants += [t for t in self._shards if t.startswith(SESSION_PREFIX)]
+        for tenant in tenants:
+            self._evicted_sessions.pop(tenant, None)
+            await asyncio.to_thread(self.store.delete, tenant)
+        return len(tenants)
+
+    async def flush_all(self) -> None:
+        """
+        Persiste tous les tenants modifiés (arrêt du serveur) ; les sessions
+        MCP ne survivent pas au redémarrage, leurs données sont supprimées.
+        """
+        await self.flush_dirty()
+        await self.purge_sessions(everything=True)